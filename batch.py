@@ -0,0 +1,162 @@
+import os, re, sys, glob, logging, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+import overview
+import writers
+
+
+def source_year(filename):
+    """
+    Extract the reporting year from the path of an export, e.g. '2023 PRI OO UID - GENERAL.csv' or 'y2023/export.csv'.
+
+    The file name is searched first, then its directories from the closest one up.
+
+    Parameters:
+    filename (str): The path to the OO export.
+
+    Returns:
+    int: The year, or None when the path does not contain one.
+    """
+
+    for part in reversed(os.path.normpath(filename).split(os.sep)):
+        match = re.search(r'(?<!\d)(20\d{2})(?!\d)', part)
+        if match:
+            return int(match.group(1))
+
+    return None
+
+def output_names(files):
+    """
+    Name the output sub-directory of every export after its path relative to the common directory
+    of the exports, without extension, e.g. 'y2022/export' and 'y2023/export'. Two files mapping to
+    the same directory, e.g. 'export.csv' and 'export.txt', raise a ValueError.
+
+    Parameters:
+    files (list): The paths of the OO exports.
+
+    Returns:
+    dict: The relative output directory of every file.
+    """
+
+    if not files:
+        return {}
+
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(filename)) for filename in files])
+    names = {filename: os.path.splitext(os.path.relpath(os.path.abspath(filename), root))[0] for filename in files}
+
+    seen = {}
+    for filename, name in names.items():
+        if name in seen:
+            raise ValueError(f'{seen[name]} and {filename} would both be written to {name}')
+        seen[name] = filename
+
+    return names
+
+def expand_inputs(inputs):
+    """
+    Expand a list of paths and glob patterns into a sorted list of unique files.
+
+    Parameters:
+    inputs (list): Paths or glob patterns.
+
+    Returns:
+    list: The matching files.
+    """
+
+    files = set()
+    for pattern in inputs:
+        matches = glob.glob(pattern)
+        if not matches:
+            logging.error('No file matches ' + pattern)
+        files.update(matches)
+
+    return sorted(files)
+
+def _run_file(filename, output_dir, streaming, output_format, partition_by, tables):
+
+    logging.basicConfig(level=logging.INFO)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Keep the stage timings, the format violations and the AUM conversion problems of every export next to its tables
+    report_file = os.path.join(output_dir, 'run_report.json')
+    violations_file = os.path.join(output_dir, 'violations.parquet')
+    aum_problems_file = os.path.join(output_dir, 'aum_problems.parquet')
+    if streaming:
+        df_signatory = overview.loading_overview_streaming(filename, output_dir, output_format, partition_by, report_file=report_file,\
+                                                           violations_file=violations_file, tables=tables, aum_problems_file=aum_problems_file)
+    else:
+        df_signatory = overview.loading_overview(filename, output_dir, output_format, partition_by, report_file=report_file,\
+                                                 violations_file=violations_file, tables=tables, aum_problems_file=aum_problems_file)
+
+    # Hand the signatory table back as a Parquet file rather than pickling the DataFrame
+    signatory_file = os.path.join(output_dir, 'signatory.parquet')
+    writers.arrow_compatible(df_signatory).to_parquet(signatory_file, index=False)
+
+    return signatory_file
+
+def run_batch(inputs, output_root, workers=None, streaming=False, combine=True, output_format='csv', partition_by=None, tables=None):
+    """
+    Run the overview pipeline on several exports in a process pool.
+
+    Every export is written to its own sub-directory of output_root, see output_names.
+
+    Parameters:
+    inputs (list): Paths or glob patterns of the OO exports.
+    output_root (str): The directory receiving one sub-directory per export.
+    workers (int): The number of worker processes. Default is None, one per CPU.
+    streaming (bool): Use loading_overview_streaming instead of loading_overview. Default is False.
+    combine (bool): Also write 'signatory_combined.parquet' with a 'source_year' column. Default is True.
+    output_format (str): The format of the per-file tables, see writers.OUTPUT_FORMATS. Default is 'csv'.
+    partition_by (str): Column the per-file Parquet tables are partitioned by. Default is None.
+    tables (list): The per-file tables written, see writers.OutputWriter. Default is None, every table.
+
+    Returns:
+    pd.DataFrame: The combined signatory table, or None when combine is False.
+    """
+
+    files = expand_inputs(inputs)
+    names = output_names(files)
+    logging.info(f'Processing {len(files)} files with {workers or os.cpu_count()} workers')
+
+    signatory_files = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run_file, filename, os.path.join(output_root, names[filename]), streaming, output_format, partition_by, tables): filename\
+                   for filename in files}
+
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                signatory_files[filename] = future.result()
+                logging.info('Finished ' + filename)
+            except Exception:
+                logging.exception('Failed to process ' + filename)
+
+    if not combine or not signatory_files:
+        return None
+
+    df_combined = pd.concat([pd.read_parquet(signatory_files[filename]).assign(source_year=source_year(filename),\
+                                                                             source_file=names[filename] + os.path.splitext(filename)[1])\
+                             for filename in files if filename in signatory_files], ignore_index=True)
+    df_combined.to_parquet(os.path.join(output_root, 'signatory_combined.parquet'), index=False)
+
+    return df_combined
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Run the overview pipeline on several PRI OO exports.')
+    parser.add_argument('inputs', nargs='+', help='paths or glob patterns of the OO exports')
+    parser.add_argument('--output', default=overview.OUTPUT_DIR, help='directory receiving one sub-directory per export')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, one per CPU by default')
+    parser.add_argument('--stream', action='store_true', help='process every export in bounded memory')
+    parser.add_argument('--no-combine', action='store_true', help='do not write the combined signatory table')
+    parser.add_argument('--format', default='csv', choices=writers.OUTPUT_FORMATS, help='format of the per-file tables')
+    parser.add_argument('--partition-by', default=None, help='column the parquet tables are partitioned by, e.g. indicator')
+    parser.add_argument('--tables', nargs='+', default=None, choices=writers.OUTPUT_TABLES, help='per-file tables to write, e.g. signatory questions facts to skip the full-text test table')
+    args = parser.parse_args()
+
+    run_batch(args.inputs, args.output, args.workers, args.stream, not args.no_combine, args.format, args.partition_by, args.tables)
+
+    sys.exit(0)
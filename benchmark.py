@@ -0,0 +1,193 @@
+import os, sys, json, time, logging, argparse, tempfile, tracemalloc
+import pandas as pd
+
+import utils
+import overview
+import synthetic
+
+
+def measure(func, *args, memory=True, repeat=3):
+    """
+    Time a call and measure its peak Python memory allocation.
+
+    The call runs repeat times for the timing, the fastest run is kept as the others only add
+    noise from the rest of the machine. When memory is True, it runs once more under tracemalloc.
+    Arguments a stage modifies in place must be copied by the caller for every call.
+
+    Parameters:
+    func (callable): The stage to run.
+    args: The arguments of the stage, or callables returning them when the stage needs fresh copies.
+    memory (bool): Also measure the peak allocation. Default is True.
+    repeat (int): The number of timed runs. Default is 3.
+
+    Returns:
+    The result of the first timed call.
+    float: The best wall time in seconds.
+    float: The peak allocation in MiB, or NaN.
+    """
+
+    def call():
+        return func(*[arg() if callable(arg) else arg for arg in args])
+
+    seconds = float('inf')
+    for i in range(max(repeat, 1)):
+        start = time.perf_counter()
+        output = call()
+        seconds = min(seconds, time.perf_counter() - start)
+        if i == 0:
+            result = output
+
+    peak = float('nan')
+    if memory:
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return result, seconds, peak
+
+def run_stages(filename, memory=True, repeat=3):
+    """
+    Run every stage of the pipeline on an export and measure them one by one.
+
+    Parameters:
+    filename (str): The path to the export.
+    memory (bool): Also measure the peak allocation of every stage. Default is True.
+    repeat (int): The number of timed runs of every stage, see measure. Default is 3.
+
+    Returns:
+    list: One dict per stage with its 'stage', 'seconds', 'peak_mib' and output 'rows'.
+    """
+
+    results = []
+    def record(stage, func, *args):
+        result, seconds, peak = measure(func, *args, memory=memory, repeat=repeat)
+        frame = result[0] if isinstance(result, tuple) else result
+        results.append({'stage': stage, 'seconds': seconds, 'peak_mib': peak, 'rows': len(frame)})
+        return result
+
+    df = record('load_csv', utils.load_csv, filename, 10000, 'ISO-8859-1')
+    df = utils.set_question_id(df)
+
+    index = utils.ResponseIndex(df)
+    df_oo1 = index.frame('OO 1')
+    record('extract_date', utils.extract_date, df_oo1)
+    df_signatory = record('build_signatory_profile', utils.build_signatory_profile, df_oo1)
+
+    df = record('set_report_id', utils.set_report_id, index.exclude(['OO 1']), df_signatory)
+    index = utils.ResponseIndex(df)
+
+    aum_frames = [index.frame(indicator, response_answer='Selected') for indicator in ['OO 4', 'OO 5', 'OO 6', 'OO 7']]
+    record('add_aum_data', overview.add_aum_data, df_signatory, *aum_frames)
+
+    df = index.exclude(overview.ENRICHMENT_INDICATORS)
+    df = record('data_cleanup', overview.data_cleanup, lambda: df.copy())
+    record('check_format', overview.check_format, df)
+    record('pre_processing', overview.pre_processing, lambda: df.copy())
+
+    df_form = utils.extract_form(df)
+    df_selected = df[df['response_answer'] == 'Selected']
+    record('extract_survey', utils.extract_survey, df_signatory, df_selected, df_form)
+
+    return results
+
+def run_benchmarks(scales, n_indicators=20, n_options=5, memory=True, workdir=None, repeat=3):
+    """
+    Generate a synthetic export per scale and measure every stage on it.
+
+    Parameters:
+    scales (list): The numbers of signatories.
+    n_indicators (int): The number of indicators after OO 7. Default is 20.
+    n_options (int): The number of options of the choice questions. Default is 5.
+    memory (bool): Also measure the peak allocation of every stage. Default is True.
+    workdir (str): The directory of the generated exports. Default is a temporary directory.
+    repeat (int): The number of timed runs of every stage, see measure. Default is 3.
+
+    Returns:
+    pd.DataFrame: One row per (scale, stage).
+    """
+
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp_dir:
+        for scale in scales:
+            filename = os.path.join(tmp_dir, f'synthetic_{scale}.csv')
+            rows = synthetic.write_export(filename, scale, n_indicators, n_options)
+            logging.info(f'Benchmarking {scale} signatories ({rows} rows)')
+
+            for result in run_stages(filename, memory, repeat):
+                results.append(dict(result, scale=scale, input_rows=rows))
+
+    return pd.DataFrame(results, columns=['scale', 'input_rows', 'stage', 'rows', 'seconds', 'peak_mib'])
+
+def save_baseline(results, filename):
+    """
+    Save benchmark results as the baseline later runs are compared to.
+
+    Parameters:
+    results (pd.DataFrame): The results of run_benchmarks.
+    filename (str): The path of the JSON file.
+    """
+
+    with open(filename, 'w') as f:
+        json.dump(results.to_dict('records'), f, indent=1)
+
+def load_baseline(filename):
+
+    with open(filename) as f:
+        return pd.DataFrame(json.load(f))
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.1):
+    """
+    Flag the stages slower or larger than the baseline by more than the tolerance.
+
+    Stages taking less than min_seconds in both runs are never flagged as slower, their timings
+    being dominated by noise.
+
+    Parameters:
+    results (pd.DataFrame): The results of run_benchmarks.
+    baseline (pd.DataFrame): The baseline results.
+    tolerance (float): The accepted relative increase. Default is 0.25.
+    min_seconds (float): The wall time below which a stage is not compared. Default is 0.1.
+
+    Returns:
+    pd.DataFrame: The results next to the baseline, with 'time_ratio', 'memory_ratio' and 'regression' columns.
+    """
+
+    df = results.merge(baseline[['scale', 'stage', 'seconds', 'peak_mib']], on=['scale', 'stage'], how='left', suffixes=('', '_baseline'))
+    df['time_ratio'] = df['seconds'] / df['seconds_baseline']
+    df['memory_ratio'] = df['peak_mib'] / df['peak_mib_baseline']
+    slower = (df['time_ratio'] > 1 + tolerance) & (df[['seconds', 'seconds_baseline']].max(axis=1) >= min_seconds)
+    df['regression'] = slower | (df['memory_ratio'] > 1 + tolerance)
+
+    return df
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Time and memory-profile the overview stages on synthetic exports.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 5000], help='numbers of signatories')
+    parser.add_argument('--indicators', type=int, default=20)
+    parser.add_argument('--options', type=int, default=5)
+    parser.add_argument('--no-memory', action='store_true', help='only measure the wall time')
+    parser.add_argument('--baseline', default=None, help='JSON baseline to compare to')
+    parser.add_argument('--save-baseline', default=None, help='write the results as a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='accepted relative increase over the baseline')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of every stage, the fastest is kept')
+    parser.add_argument('--min-seconds', type=float, default=0.1, help='wall time below which a stage is not flagged as slower')
+    args = parser.parse_args()
+
+    # The stages report every data issue of the synthetic data, keep the benchmark output readable
+    logging.getLogger().setLevel(logging.CRITICAL)
+    results = run_benchmarks(args.scales, args.indicators, args.options, not args.no_memory, repeat=args.repeat)
+    logging.getLogger().setLevel(logging.INFO)
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+
+    if args.baseline:
+        results = compare(results, load_baseline(args.baseline), args.tolerance, args.min_seconds)
+
+    print(results.to_string(index=False))
+
+    sys.exit(1 if args.baseline and results['regression'].any() else 0)
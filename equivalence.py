@@ -0,0 +1,171 @@
+import os, sys, logging, argparse, tempfile
+import numpy as np
+import pandas as pd
+
+import overview
+import pipeline
+import synthetic
+import writers
+
+# The column specs of the signatory profile, the synthetic export answers every question they read
+PROFILE_SPECS = [overview.SUBSIDIARIES_COLUMNS, overview.FUNDRAISING_COLUMNS, overview.AUM_COLUMNS]
+
+def read_tables(output_dir, output_format):
+    """
+    Read the tables of a run back from its output directory.
+
+    Parameters:
+    output_dir (str): The directory the tables were written to.
+    output_format (str): 'csv' or 'parquet'.
+
+    Returns:
+    dict: The writers.OUTPUT_TABLES by name.
+    """
+
+    tables = {}
+    for name in writers.OUTPUT_TABLES:
+        path = os.path.join(output_dir, f'{name}.{output_format}')
+        tables[name] = pd.read_parquet(path) if output_format == 'parquet' else pd.read_csv(path, dtype=str, keep_default_na=False)
+
+    return tables
+
+def _sorted(df):
+
+    order = df.astype(str).sort_values(list(df.columns), kind='stable').index
+
+    return df.loc[order].reset_index(drop=True)
+
+def compare_tables(expected, actual, ordered=True):
+    """
+    Compare two tables, their values, columns and dtypes.
+
+    Categorical columns only need the same values, not the same categories, as a table appended
+    chunk by chunk collects its categories in another order.
+
+    Parameters:
+    expected (pd.DataFrame): The reference table.
+    actual (pd.DataFrame): The table to check.
+    ordered (bool): The rows must come in the same order. Default is True.
+
+    Returns:
+    str: The first difference, or None when the tables match.
+    """
+
+    if not ordered:
+        expected, actual = _sorted(expected), _sorted(actual)
+
+    try:
+        pd.testing.assert_frame_equal(expected, actual, check_categorical=False, check_dtype=False)
+    except AssertionError as error:
+        return ' '.join(str(error).split())
+
+    dtypes = [col for col in expected.columns if expected[col].dtype.kind != actual[col].dtype.kind\
+              or isinstance(expected[col].dtype, pd.CategoricalDtype) != isinstance(actual[col].dtype, pd.CategoricalDtype)]
+    if dtypes:
+        return f'dtypes differ in {dtypes}: {[str(expected[col].dtype) for col in dtypes]} != {[str(actual[col].dtype) for col in dtypes]}'
+
+    return None
+
+def _update_export(df):
+
+    # The next export of the same signatories: the first one withdrew, the second one changed an answer
+    # and the last one is new, the rows are numbered again
+    names = df['Signatory Name'].unique()
+    df = df[df['Signatory Name'] != names[0]].copy()
+    df['UID'] = np.arange(1, len(df) + 1)
+
+    changed = (df['Signatory Name'] == names[1]) & df[' Signatory_Public_Response '].notna()
+    df.loc[changed.idxmax(), ' Signatory_Public_Response '] = 'US$ 1,000.00'
+
+    return df
+
+def run_modes(workdir, n_signatories=200, n_indicators=20, n_options=5, chunk_size=2000, seed=0):
+    """
+    Run every mode of the overview pipeline on a synthetic export and compare their tables with
+    the ones of loading_overview.
+
+    The streaming mode runs with small chunks so several of them are appended. The incremental mode
+    runs once from scratch, then on a second export where a signatory withdrew, one changed and
+    one is new, and is compared with loading_overview on that export. Its rows come in another order
+    and its question dictionary keeps the questions of withdrawn signatories, so the rows are sorted
+    and only the questions of the full run are compared. The pipeline runs twice, the second time
+    from its cached stages. The signatory profile of loading_overview must have values in every
+    column of PROFILE_SPECS, an empty column being reported as a difference.
+
+    Parameters:
+    workdir (str): The directory of the exports and of the outputs of every mode.
+    n_signatories (int): The number of signatories. Default is 200.
+    n_indicators (int): The number of indicators after OO 7. Default is 20.
+    n_options (int): The number of options of the choice questions. Default is 5.
+    chunk_size (int): The number of rows per chunk of the streaming mode. Default is 2000.
+    seed (int): The seed of the synthetic export. Default is 0.
+
+    Returns:
+    pd.DataFrame: One row per (mode, table) with its number of rows and the first difference, None when it matches.
+    """
+
+    output_format = 'parquet' if writers.pa is not None else 'csv'
+
+    df = synthetic.generate_export(n_signatories + 1, n_indicators, n_options, seed)
+    last = df['Signatory Name'] == df['Signatory Name'].iloc[-1]
+
+    filename = os.path.join(workdir, 'export.csv')
+    df[~last].to_csv(filename, index=False, encoding='ISO-8859-1', errors='replace')
+    updated_file = os.path.join(workdir, 'export_updated.csv')
+    _update_export(df).to_csv(updated_file, index=False, encoding='ISO-8859-1', errors='replace')
+
+    def output(mode):
+        return os.path.join(workdir, mode)
+
+    results = []
+    def compare(mode, expected, ordered=True):
+        for name, df_actual in read_tables(output(mode), output_format).items():
+            if not ordered and name == 'questions':
+                df_actual = df_actual[df_actual['question_id'].isin(expected[name]['question_id'])]
+            results.append({'mode': mode, 'table': name, 'rows': len(df_actual), 'difference': compare_tables(expected[name], df_actual, ordered)})
+
+    df_signatory = overview.loading_overview(filename, output('memory'), output_format)
+    expected = read_tables(output('memory'), output_format)
+
+    empty = [col for col in pd.concat(PROFILE_SPECS)['column'] if df_signatory[col].isna().all()]
+    results.append({'mode': 'memory', 'table': 'signatory', 'rows': len(df_signatory),\
+                    'difference': f'empty spec columns {empty}' if empty else None})
+
+    overview.loading_overview_streaming(filename, output('streaming'), output_format, chunk_size=chunk_size)
+    compare('streaming', expected)
+
+    overview.loading_overview_incremental(filename, output('incremental'), output_format)
+    compare('incremental', expected)
+
+    pipeline.run_pipeline(filename, output('pipeline'), output_format)
+    compare('pipeline', expected)
+    pipeline.run_pipeline(filename, output('pipeline_cached'), output_format, cache_dir=os.path.join(output('pipeline'), '.overview_cache'))
+    compare('pipeline_cached', expected)
+
+    overview.loading_overview(updated_file, output('memory_updated'), output_format)
+    overview.loading_overview_incremental(updated_file, output('incremental'), output_format)
+    os.rename(output('incremental'), output('incremental_updated'))
+    compare('incremental_updated', read_tables(output('memory_updated'), output_format), ordered=False)
+
+    return pd.DataFrame(results, columns=['mode', 'table', 'rows', 'difference'])
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Check that every mode of the overview pipeline writes the tables of loading_overview.')
+    parser.add_argument('--signatories', type=int, default=200)
+    parser.add_argument('--indicators', type=int, default=20)
+    parser.add_argument('--options', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=2000, help='rows per chunk of the streaming mode')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The stages report every data issue of the synthetic data, keep the output readable
+    logging.getLogger().setLevel(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_modes(tmp_dir, args.signatories, args.indicators, args.options, args.chunk_size, args.seed)
+    logging.getLogger().setLevel(logging.INFO)
+
+    print(results.fillna({'difference': 'match'}).to_string(index=False))
+
+    sys.exit(1 if results['difference'].notna().any() else 0)
@@ -0,0 +1,215 @@
+import sys, json, time, logging, platform, functools, threading, tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peak_rss():
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _shape(obj):
+
+    # Stages returning several tables, e.g. (df, report), are sized by their first table
+    if isinstance(obj, tuple):
+        obj = next((item for item in obj if isinstance(item, (pd.DataFrame, pd.Series))), None)
+
+    if isinstance(obj, pd.DataFrame):
+        return list(obj.shape)
+    if isinstance(obj, pd.Series):
+        return [len(obj), 1]
+
+    return None
+
+def _mib(n_bytes):
+
+    return None if n_bytes is None else round(n_bytes / 2**20, 3)
+
+class Stage:
+    """
+    Handle of a stage being measured, see RunReport.stage.
+    """
+
+    def __init__(self, inputs):
+
+        self.input_shape = next((shape for shape in map(_shape, inputs) if shape is not None), None)
+        self.output_shape = None
+
+    def output(self, obj):
+        """
+        Record the output of the stage and return it unchanged.
+        """
+
+        self.output_shape = _shape(obj)
+        return obj
+
+class RunReport:
+    """
+    Collect the wall time, CPU time, memory and table sizes of the stages of a run.
+
+    Measure a stage with the stage context manager, the run method or the track decorator.
+    A stage measured several times, e.g. once per chunk, is reported once with its totals.
+
+    Stages may run in several threads, e.g. the stages of pipeline.Pipeline. Their CPU time is the one
+    of their thread, while the peak RSS is the one of the process and its growth during a stage may
+    come from the stages running at the same time.
+
+    Parameters:
+    name (str): The name of the run, e.g. the export file.
+    trace_memory (bool): Also measure the peak Python allocation of every stage with tracemalloc,
+                         which slows the run down. Default is False.
+    """
+
+    def __init__(self, name=None, trace_memory=False):
+
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started = datetime.now(timezone.utc)
+        self.stages = {}
+        self._lock = threading.Lock()
+
+        self._start = time.perf_counter()
+        self._owns_trace = trace_memory and not tracemalloc.is_tracing()
+        if self._owns_trace:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, *inputs):
+        """
+        Measure the stage run in the with block.
+
+        Stages must not be nested or run concurrently when trace_memory is True, as each one resets the traced peak.
+
+        Parameters:
+        name (str): The name of the stage.
+        inputs: The input tables of the stage, the first one is used for the input size.
+
+        Yields:
+        Stage: Call its output method with the output of the stage to record its size.
+        """
+
+        stage = Stage(inputs)
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = _peak_rss()
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+
+        try:
+            yield stage
+        finally:
+            seconds = time.perf_counter() - start
+            cpu_seconds = time.thread_time() - cpu_start
+            rss_after = _peak_rss()
+            traced_peak = tracemalloc.get_traced_memory()[1] - traced_before if self.trace_memory else None
+
+            self._record(name, {'calls': 1,
+                                'wall_seconds': seconds,
+                                'cpu_seconds': cpu_seconds,
+                                'peak_rss_mib': _mib(rss_after),
+                                'peak_rss_growth_mib': _mib(None if rss_after is None else rss_after - rss_before),
+                                'traced_peak_mib': _mib(traced_peak),
+                                'input_rows': stage.input_shape and stage.input_shape[0],
+                                'input_columns': stage.input_shape and stage.input_shape[1],
+                                'output_rows': stage.output_shape and stage.output_shape[0],
+                                'output_columns': stage.output_shape and stage.output_shape[1]})
+
+            logging.debug(f'{name} took {seconds:.3f}s')
+
+    def _record(self, name, record):
+
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = record
+                return
+
+            # Sum times and row counts over the calls, keep the largest memory figures and the last column counts
+            total = self.stages[name]
+            for key, value in record.items():
+                if value is None:
+                    continue
+                if key in ('calls', 'wall_seconds', 'cpu_seconds', 'input_rows', 'output_rows', 'peak_rss_growth_mib'):
+                    total[key] = (total[key] or 0) + value
+                elif key in ('peak_rss_mib', 'traced_peak_mib'):
+                    total[key] = max(total[key] or 0, value)
+                else:
+                    total[key] = value
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) as a stage and return its result.
+        """
+
+        with self.stage(name, *args) as stage:
+            return stage.output(func(*args, **kwargs))
+
+    def track(self, name=None):
+        """
+        Decorator measuring every call of a function as a stage, named after the function by default.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.run(name or func.__name__, func, *args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def to_dict(self):
+        """
+        Return the report as a JSON serializable dict.
+        """
+
+        with self._lock:
+            stages = [{'stage': name, **record, 'wall_seconds': round(record['wall_seconds'], 6), 'cpu_seconds': round(record['cpu_seconds'], 6)}\
+                      for name, record in self.stages.items()]
+
+        return {'run': self.name,
+                'started': self.started.isoformat(),
+                'wall_seconds': round(time.perf_counter() - self._start, 6),
+                'peak_rss_mib': _mib(_peak_rss()),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'stages': stages}
+
+    def write(self, filename):
+        """
+        Write the report to a JSON file and stop tracing the memory if the report started it.
+
+        Parameters:
+        filename (str): The path of the JSON file.
+        """
+
+        if self._owns_trace:
+            tracemalloc.stop()
+            self._owns_trace = False
+            self.trace_memory = False
+
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+        logging.info('Run report written to ' + filename)
+
+def log_report(report):
+    """
+    Log the stages of a run report as a table, slowest first.
+
+    Parameters:
+    report (RunReport): The report.
+    """
+
+    df = pd.DataFrame(report.to_dict()['stages']).set_index('stage')
+    logging.info(f"Stage timings:\n{df.sort_values('wall_seconds', ascending=False)[['calls', 'wall_seconds', 'cpu_seconds', 'peak_rss_mib', 'input_rows', 'output_rows']].to_string()}")
@@ -1,156 +1,193 @@
-import sys, logging
+import os, re, sys, hashlib, inspect, logging, argparse, tempfile
+import numpy as np
 import pandas as pd
 
+import instrumentation
+import store
 import utils
+import validation
+import writers
 
 
 OO_file = '/mnt/c/Users/laure/OneDrive/Documents/Obsidian Vault/Joe/data/2023 PRI OO UID - GENERAL.csv'
 
 public_response = ' Signatory_Public_Response '
 
-def data_cleanup(df):
-   
-    # cleaning data in OO 5.3 HF
-    logging.info('Cleaning OO 5.3 HF')
-    condition = (df['indicator'] == 'OO 5.3 HF') & (df['question_text'] == '(H) Other strategies - Specify:')
-    df.loc[condition, 'question_text'] = 'Provide a further breakdown of your internally managed hedge fund assets.'
-    df.loc[condition, 'sub_question_text'] = '(I) Other strategies - Specify:'
-
-    # cleaning data in OO 5.3 INF
-    logging.info('Cleaning OO 5.3 INF')
-    condition = (df['indicator'] == 'OO 5.3 INF') & (df['question_text'] == '(J) Other - Specify:')
-    df.loc[condition, 'question_text'] = 'Provide a further breakdown of your internally managed infrastructure AUM.'
-    df.loc[condition, 'sub_question_text'] = '(K) Other - Specify:'
-
-    # cleaning data in OO 5.3 LE
-    logging.info('Cleaning OO 5.3 LE')
-    condition = (df['indicator'] == 'OO 5.3 LE') & (df['question_text'] == '(D) Other strategies - Specify:')
-    df.loc[condition, 'question_text'] = 'Provide a further breakdown of your internally managed listed equity AUM.'
-    df.loc[condition, 'sub_question_text'] = '(E) Other strategies - Specify:'
-
-    # cleaning data in OO 5.3 PE
-    logging.info('Cleaning OO 5.3 PE')
-    condition = (df['indicator'] == 'OO 5.3 PE') & (df['question_text'] == '(F) Other - Specify:')
-    df.loc[condition, 'question_text'] = 'Provide a further breakdown of your internally managed private equity AUM.'
-    df.loc[condition, 'sub_question_text'] = '(G) Other - Specify:'
-
-    # cleaning data in OO 5.3 RE
-    logging.info('Cleaning OO 5.3 RE')
-    condition = (df['indicator'] == 'OO 5.3 RE') & (df['question_text'] == '(K) Other - Specify:')
-    df.loc[condition, 'question_text'] = 'Provide a further breakdown of your internally managed real estate AUM.'
-    df.loc[condition, 'sub_question_text'] = '(L) Other - Specify:'
-
-    # cleaning data in OO 10
-    logging.info('Cleaning OO 10')
-    df.loc[df['indicator'] == 'OO 10', 'sub_question_text'] = df.loc[df['indicator'] == 'OO 10', 'sub_question_text'].str.replace('Stewardship, excluding (proxy) voting', '(A) Stewardship, excluding (proxy) voting')
-
-    # cleaning data in OO 15
-    indicator_filter = 'OO 15'
-    logging.info('Cleaning ' + indicator_filter)
-    df.loc[df['indicator'] == indicator_filter, 'sub_question_text'] = df.loc[df['indicator'] == indicator_filter, 'sub_question_text'].str.replace('Externally managed', '(A) Externally managed')
-    df.loc[df['indicator'] == indicator_filter, 'sub_question_text'] = df.loc[df['indicator'] == indicator_filter, 'sub_question_text'].str.replace('Internally managed', '(B) Internally managed')
-    
-    # cleaning data in OO 16
-    indicator_filter = 'OO 16'
-    logging.info('Cleaning ' + indicator_filter)
-    df.loc[df['indicator'] == indicator_filter, 'sub_question_text'] = df.loc[df['indicator'] == indicator_filter, 'sub_question_text'].str.replace('Externally managed', '(A) Externally managed')
-    df.loc[df['indicator'] == indicator_filter, 'sub_question_text'] = df.loc[df['indicator'] == indicator_filter, 'sub_question_text'].str.replace('Internally managed', '(B) Internally managed')
-
-    ## cleaning data in OO 18
-    logging.info('Cleaning OO 18')
-    condition = (df['indicator'] == 'OO 18') & (df['question_text'] == 'Additional information: (Voluntary)')
-    df.loc[condition, 'question_text'] = 'Do you explicitly market any of your products and/or funds as ESG and/or sustainable?'
-    df.loc[condition, 'sub_question_text'] = '(D) Additional information: (Voluntary)'
-    
-    # cleaning data in OO 20
-    logging.info('Cleaning OO 20')
-    condition = (df['indicator'] == 'OO 20') & (df['question_text'] == '(F) Other - Specify:')
-    df.loc[condition, 'question_text'] = 'What percentage of your total environmental and/or social thematic bonds are labelled by the issuers in accordance with industry-recognised standards?'
-    df.loc[condition, 'sub_question_text'] = '(G) Other - Specify:'
-
-    # cleaning data in OO 21
-    indicator_filter = 'OO 21'
-    logging.info('Cleaning ' + indicator_filter)
-    df.loc[df['indicator'] == indicator_filter, 'sub_question_text'] = df.loc[df['indicator'] == indicator_filter, 'sub_question_text'].str.replace('Confidence Building Measures', '(1) Confidence Building Measures')
-    df.loc[df['indicator'] == indicator_filter, 'sub_question_text'] = df.loc[df['indicator'] == indicator_filter, 'sub_question_text'].str.replace('Policy, Governance and Strategy', '(2) Policy, Governance and Strategy')
+OUTPUT_DIR = os.environ.get('OO_OUTPUT_DIR', '/home/lngo/projects/Joe')
 
-    return df
+CLEANUP_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleanup_rules.csv')
 
-def check_format(df):
-    # Define the expected pattern using regular expressions
-    # expected_pattern = r'\([^)]+\)\s.*'
-    expected_pattern = r'^\([A-Za-z0-9]+\)\s.+'
+def _log_cleanup(report):
 
-    # Filter rows where 'sub_question_text' does not match the expected pattern
-    regex_match = df['sub_question_text'].str.match(expected_pattern)
-    
-    # Filter rows where 'sub_question_text' is NaN
-    nan_rows = df['sub_question_text'].isna()
-    
-    # Combine the two conditions using bitwise OR (|)
-    mismatched_rows = df[~(regex_match | nan_rows)]
+    logging.info(f"Cleanup rows touched per rule:\n{report[['indicator', 'target_column', 'rows_touched']].to_string()}")
+
+def data_cleanup(df, index=None, rules_file=CLEANUP_RULES_FILE):
+
+    rules = utils.load_cleanup_rules(rules_file)
+
+    df, report = utils.apply_cleanup_rules(df, rules, index)
 
-    if mismatched_rows.empty:
-        logging.info("Checked format for column 'sub_question_text'")
+    _log_cleanup(report)
+
+    return df
+
+def log_format(summary):
+
+    if summary.empty:
+        logging.info("Checked format of the response table")
     else:
-        for index, row in mismatched_rows.iterrows():
-            logging.error(f"Row {index}: '{row['Signatory Name']}' '{row['indicator']}' '{row['question_text']}' '{row['sub_question_text']}' does not match the specified format.")
+        logging.error(f"{summary['violations'].sum()} values do not match the specified format:\n{summary.to_string(index=False)}")
+
+def check_format(df, report_file=None):
+
+    violations, summary = validation.run_checks(df)
+
+    log_format(summary)
+    if report_file is not None:
+        validation.write_report(violations, summary, report_file)
         
     return df
 
+# Label column of each question-text level, e.g. '(A) Listed equity' is split into 'A' and ' Listed equity'
+LABEL_COLUMNS = {'question_text': 'question_label',
+                 'sub_question_text': 'sub_question_label',
+                 'sub_sub_question_text': 'sub_sub_question_label',
+                 'sub_sub_sub_question_text': 'sub_sub_sub_question_label'}
+
+LABEL_PATTERN = r'^([^)]*)\)(.*)$'
+
+# (label, text) of every distinct question text split so far
+_label_cache = {}
+
+def _split_labels(values):
+
+    missing = [value for value in values if value not in _label_cache]
+
+    if missing:
+        parts = pd.Series(missing, dtype=object).str.extract(LABEL_PATTERN, flags=re.DOTALL)
+        # Without a closing parenthesis the whole value is the label and there is no text
+        labels = parts[0].fillna(pd.Series(missing, dtype=object)).str.replace('(', '', regex=False)
+        _label_cache.update(zip(missing, zip(labels.tolist(), parts[1].tolist())))
+
+    return [_label_cache[value] for value in values]
+
 def split_label_from_text(df, col, label_col):
+    """
+    Split the '(label) text' values of a column into a label column and the remaining text.
 
-    logging.info( 'Spliting label from text in column ' + col)
+    Every distinct value is parsed once and memoized, the results are mapped back to the rows
+    through the factorized codes and stored as categoricals. The frame is updated in place.
+    
+    Parameters:
+    df (pd.DataFrame): The response table.
+    col (str): The question-text column to split, keeps the text.
+    label_col (str): The column receiving the label.
 
-    df = df.copy()  # Ensure we're working with a copy of the DataFrame
+    Returns:
+    pd.DataFrame: The DataFrame with the split columns.
+    """
 
-    split_columns = df[col].str.split(')', n=1, expand=True)
-    df.loc[:,label_col] = split_columns[0].str.replace('(', '')
-    df.loc[:,col] = split_columns[1]
+    logging.info( 'Spliting label from text in column ' + col)
+
+    codes, uniques = pd.factorize(df[col])
+    split = _split_labels(uniques.tolist())
 
-    if split_columns.shape[1] > 2:
-        logging.error( 'split_label_from_text: extracted more than 2 columns for column '+ col )
+    for target, values in [(label_col, [label for label, _ in split]), (col, [text for _, text in split])]:
+        value_codes, categories = pd.factorize(pd.Series(values, dtype=object))
+        row_codes = np.where(codes >= 0, value_codes[codes], -1)
+        df[target] = pd.Categorical.from_codes(row_codes, categories)
 
     return df
 
-def pre_processing(df):
+def pre_processing(df, columns=('sub_question_text', 'sub_sub_question_text')):
     
-    df = split_label_from_text(df,'sub_question_text', 'sub_question_label')
-    df = split_label_from_text(df,'sub_sub_question_text', 'sub_sub_question_label')
+    for col in columns:
+        df = split_label_from_text(df, col, LABEL_COLUMNS[col])
 
     return df
 
+OO2_2_n_question = 'How many subsidiaries of your organisation are PRI signatories in their own rights?'
+OO2_2_list_question = 'List any subsidiaries of your organisation that are PRI signatories in their own right and indicate if the responsible investment activities of the listed subsidiaries will be reported in this submission.'
+
+SUBSIDIARIES_COLUMNS = utils.build_column_spec([
+    ('OO2_has_subsidiaries', 'OO 2', None, None, None, None, 'sub_question_text'),
+    ('OO2_subsidiaries_PRI_signatory', 'OO 2.1', None, None, None, None, 'sub_question_text'),
+    ('OO2_n_subsidiaries', 'OO 2.2', None, OO2_2_n_question, None, None, 'sub_question_text'),
+    ('OO2_subsidiary_signatory', 'OO 2.2', 'Text', OO2_2_list_question, None, None, public_response),
+    ('OO2_subsidiary_activity_included', 'OO 2.2', 'Single Choice', OO2_2_list_question, None, None, 'sub_sub_question_text'),
+])
+
+FUNDRAISING_COLUMNS = utils.build_column_spec([
+    ('OO3_fundraising_end_date', 'OO 3', 'Text', None, None, None, public_response),
+])
+
+sub_sub_question_1 = '(1) Percentage of Internally managed AUM'
+sub_sub_question_2 = '(2) Percentage of Externally managed AUM'
+
+AUM_COLUMNS = utils.build_column_spec([
+    # OO 4
+    ('OO4_AUM_org', 'OO 4', 'Money', None, '(A) AUM of your organisation, including subsidiaries, and excluding the AUM subject to execution, advisory, custody, or research advisory only', None, public_response),
+    ('OO4_AUM_subsidiaries', 'OO 4', 'Money', None, '(B) AUM of subsidiaries that are PRI signatories in their own right and excluded from this submission, as indicated in [OO 2.2]', None, public_response),
+    ('OO4_AUM_exec', 'OO 4', 'Money', None, '(C) AUM subject to execution, advisory, custody, or research advisory only', None, public_response),
+    ('OO4_AUM_FX_Rate', 'OO 4', 'Text', None, None, None, public_response),
+
+    # OO 5
+    ('OO5_AUM_PCT_Equity_INT', 'OO 5', 'Percentage', None, '(A) Listed equity', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Equity_EXT', 'OO 5', 'Percentage', None, '(A) Listed equity', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Fixed_Income_INT', 'OO 5', 'Percentage', None, '(B) Fixed income', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Fixed_Income_EXT', 'OO 5', 'Percentage', None, '(B) Fixed income', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Private_Equity_INT', 'OO 5', 'Percentage', None, '(C) Private equity', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Private_Equity_EXT', 'OO 5', 'Percentage', None, '(C) Private equity', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Real_Estate_INT', 'OO 5', 'Percentage', None, '(D) Real estate', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Real_Estate_EXT', 'OO 5', 'Percentage', None, '(D) Real estate', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Infrastructure_INT', 'OO 5', 'Percentage', None, '(E) Infrastructure', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Infrastructure_EXT', 'OO 5', 'Percentage', None, '(E) Infrastructure', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Hedge_Fund_INT', 'OO 5', 'Percentage', None, '(F) Hedge funds', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Hedge_fund_EXT', 'OO 5', 'Percentage', None, '(F) Hedge funds', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Forestry_INT', 'OO 5', 'Percentage', None, '(G) Forestry', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Forestry_EXT', 'OO 5', 'Percentage', None, '(G) Forestry', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Other_INT', 'OO 5', 'Percentage', None, '(I) Other', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Other_EXT', 'OO 5', 'Percentage', None, '(I) Other', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Other_details_INT', 'OO 5', 'Text', None, '(I) Other - (1) Percentage of Internally managed AUM - Specify:', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Other_details_EXT', 'OO 5', 'Text', None, '(I) Other - (2) Percentage of Externally managed AUM - Specify:', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Off_balance_INT', 'OO 5', 'Percentage', None, '(J) Off-balance sheet', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Off_balance_EXT', 'OO 5', 'Percentage', None, '(J) Off-balance sheet', sub_sub_question_2, public_response),
+    ('OO5_AUM_PCT_Off_balance_details_INT', 'OO 5', 'Text', None, '(J) Off-balance sheet - (1) Percentage of Internally managed AUM - Specify:', sub_sub_question_1, public_response),
+    ('OO5_AUM_PCT_Off_balance_details_EXT', 'OO 5', 'Text', None, '(J) Off-balance sheet - (2) Percentage of Externally managed AUM - Specify:', sub_sub_question_1, public_response),
+
+    # OO 6
+    ('OO6_AUM_PCT_subsidiaries_PRI_signatory', 'OO 6', None, None, None, None, public_response),
+
+    # OO 7, the export is written in Windows-1252 and read as ISO-8859-1, so its en dashes come in as '\x96'
+    ('OO7_AUM_PCT_Listed_Equity_Emerging_mkt', 'OO 7', None, None, '(A) Listed equity', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Fixed_Income_SSA_Emerging_mkt', 'OO 7', None, None, '(B) Fixed income \x96 SSA', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Fixed_Income_Corp_Emerging_mkt', 'OO 7', None, None, '(C) Fixed income \x96 corporate', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Fixed_Income_Securities_Emerging_mkt', 'OO 7', None, None, '(D) Fixed income \x96 securitised', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Fixed_Income_Private_Debt_Emerging_mkt', 'OO 7', None, None, '(E) Fixed income \x96 private debt', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Private_Equity_Emerging_mkt', 'OO 7', None, None, '(F) Private equity', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Real_State_Emerging_mkt', 'OO 7', None, None, '(G) Real estate', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Infra_Emerging_mkt', 'OO 7', None, None, '(H) Infrastructure', None, 'sub_sub_sub_question_text'),
+    ('OO7_AUM_PCT_Hedge_Funds_Emerging_mkt', 'OO 7', None, None, '(I) Hedge funds', None, 'sub_sub_sub_question_text'),
+
+    # OO 8
+])
+
 def add_subsidiaries_data(df, df_oo2, df_oo2_1, df_oo2_2 ):
  
     logging.info('Adding subsidiaries data')
 
-    df = pd.merge(df, df_oo2[['report_ID', 'sub_question_text']], on='report_ID', how='left', validate=None)
-    df['sub_question_text'] = df['sub_question_text'].replace('(A) Yes', True)
-    df['sub_question_text'] = df['sub_question_text'].replace('(B) No', False)
-    df = df.rename(columns={'sub_question_text': 'OO2_has_subsidiaries'})
-
-    df = pd.merge(df, df_oo2_1[['report_ID', 'sub_question_text']], on='report_ID', how='left', validate=None)
-    df['sub_question_text'] = df['sub_question_text'].replace('(A) Yes', True)
-    df['sub_question_text'] = df['sub_question_text'].replace('(B) No', False)
-    df = df.rename(columns={'sub_question_text': 'OO2_subsidiaries_PRI_signatory'})
-
-    df_right = df_oo2_2[(df_oo2_2['question_text'] == 'How many subsidiaries of your organisation are PRI signatories in their own rights?')]
-    df = pd.merge(df, df_right[['report_ID', 'sub_question_text']], on='report_ID', how='left', validate=None)
-    df = df.rename(columns={'sub_question_text': 'OO2_n_subsidiaries'})
+    df = utils.pivot_columns(df, pd.concat([df_oo2, df_oo2_1, df_oo2_2]), SUBSIDIARIES_COLUMNS)
 
-    df_right = df_oo2_2[(df_oo2_2['question_text'] == 'List any subsidiaries of your organisation that are PRI signatories in their own right and indicate if the responsible investment activities of the listed subsidiaries will be reported in this submission.')\
-                         & (df_oo2_2['question_type_pri'] == 'Text')]
-    df = pd.merge(df, df_right[['report_ID', public_response]], on='report_ID', how='left', validate=None)
-    df = df.rename(columns={' Signatory_Public_Response ': 'OO2_subsidiary_signatory'})
+    yes_no = {'(A) Yes': True, '(B) No': False}
+    included = {'(1) Yes, the responsible investment activities of this subsidiary will be included in this report': True,
+                '(2) No, the responsible investment activities of this subsidiary will be included in their separate report': False}
 
-    df_right = df_oo2_2[(df_oo2_2['question_text'] == 'List any subsidiaries of your organisation that are PRI signatories in their own right and indicate if the responsible investment activities of the listed subsidiaries will be reported in this submission.')\
-                         & (df_oo2_2['question_type_pri'] == 'Single Choice')]
-    df = pd.merge(df, df_right[['report_ID', 'sub_sub_question_text']], on='report_ID', how='left', validate=None)
-    
-    df['sub_sub_question_text'] = df['sub_sub_question_text'].replace('(1) Yes, the responsible investment activities of this subsidiary will be included in this report', True)
-    df['sub_sub_question_text'] = df['sub_sub_question_text'].replace('(2) No, the responsible investment activities of this subsidiary will be included in their separate report', False)
-    
-    df = df.rename(columns={'sub_sub_question_text': 'OO2_subsidiary_activity_included'})
+    # Nullable booleans, so the dtype survives the exports and the store even when a column only holds missing values
+    for col, mapping in [('OO2_has_subsidiaries', yes_no), ('OO2_subsidiaries_PRI_signatory', yes_no), ('OO2_subsidiary_activity_included', included)]:
+        unknown = df[col].notna() & ~df[col].isin(list(mapping))
+        if unknown.any():
+            logging.error(f"Unexpected answers in {col}, left missing: {df.loc[unknown, col].unique().tolist()}")
+        df[col] = df[col].map(mapping).astype('boolean')
 
     return df
 
@@ -158,7 +195,7 @@ def add_fundraising_data( df, df_oo3 ):
 
     logging.info('Adding fundraising data')
 
-    df = utils.merge_and_rename_column(df,  df_oo3[(df_oo3['question_type_pri'] == 'Text')], public_response, 'OO3_fundraising_end_date')
+    df = utils.pivot_columns(df, df_oo3, FUNDRAISING_COLUMNS)
 
     return df
 
@@ -166,129 +203,494 @@ def add_aum_data(df, df_oo4, df_oo5, df_oo6, df_oo7 ):
 
     logging.info('Adding AUM data')
 
+    df = utils.pivot_columns(df, pd.concat([df_oo4, df_oo5, df_oo6, df_oo7]), AUM_COLUMNS)
 
-    # OO 4
-    df_temp = df_oo4[(df_oo4['question_type_pri'] == 'Money')]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_question_text'] == '(A) AUM of your organisation, including subsidiaries, and excluding the AUM subject to execution, advisory, custody, or research advisory only' )], public_response, 'OO4_AUM_org')
-    df = utils.merge_and_rename_column(df,  df_temp[ (df_temp['sub_question_text'] == '(B) AUM of subsidiaries that are PRI signatories in their own right and excluded from this submission, as indicated in [OO 2.2]' )], public_response, 'OO4_AUM_subsidiaries')
-    df = utils.merge_and_rename_column(df,  df_temp[ (df_temp['sub_question_text'] == '(C) AUM subject to execution, advisory, custody, or research advisory only' )], public_response, 'OO4_AUM_exec')
-
-    df = utils.merge_and_rename_column(df,  df_oo4[(df_oo4['question_type_pri'] == 'Text')], public_response, 'OO4_AUM_FX_Rate')
+    return df
 
-    # OO 5
-    sub_sub_question_1 = '(1) Percentage of Internally managed AUM'
-    sub_sub_question_2 = '(2) Percentage of Externally managed AUM'
+# Numeric type of the AUM columns, their question_type_pri or the one of their values, None for plain numbers
+AUM_NUMERIC_TYPES = {**{spec['column']: spec['question_type_pri'] for spec in AUM_COLUMNS.to_dict('records')\
+                        if spec['question_type_pri'] in (utils.MONEY_TYPE_PRI, utils.PERCENTAGE_TYPE_PRI)},
+                     'OO4_AUM_FX_Rate': None,
+                     'OO6_AUM_PCT_subsidiaries_PRI_signatory': utils.PERCENTAGE_TYPE_PRI,
+                     **{col: utils.PERCENTAGE_TYPE_PRI for col in AUM_COLUMNS['column'] if col.startswith('OO7_')}}
+
+FX_RATE_COLUMN = 'OO4_AUM_FX_Rate'
+
+# The emerging market shares of OO 7 are bands, e.g. '>10-50%', converted to their bounds
+AUM_BAND_COLUMNS = [col for col in AUM_COLUMNS['column'] if col.startswith('OO7_')]
+
+def convert_aum_data(df):
+    """
+    Add the numeric values of the AUM columns of the signatory profile and the AUM in US dollars.
+
+    The responses are kept as answered, e.g. the text of an FX rate or the '>75%' band of an OO 7
+    option, and every AUM column gets float64 twins, see utils.parse_numeric and utils.parse_range:
+    a '_value' twin, or '_low' and '_high' twins with the bounds of the AUM_BAND_COLUMNS bands.
+    Percentages are on a 0-100 scale. Every Money column also gets a '_USD' twin: amounts in
+    US dollars are kept, the others are multiplied by the OO4_AUM_FX_Rate, taken as US dollars
+    per unit of the reporting currency. Without a rate, amounts without a currency are taken as
+    US dollars.
     
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(A) Listed equity')]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Equity_INT')    
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Equity_EXT')    
+    Parameters:
+    df (pd.DataFrame): The signatory profile with the AUM_COLUMNS.
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(B) Fixed income') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Fixed_Income_INT')    
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Fixed_Income_EXT')  
+    Returns:
+    pd.DataFrame: The signatory profile with the numeric twins of the AUM columns.
+    pd.DataFrame: The report_ID, indicator, column, rule and value of every response that could not be
+                  converted, laid out as a validation report, see validation.write_report.
+    """
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(C) Private equity') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Private_Equity_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Private_Equity_EXT')     
+    logging.info('Converting AUM data')
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(D) Real estate') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Real_Estate_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Real_Estate_EXT') 
+    indicators = AUM_COLUMNS.set_index('column')['indicator']
+    problems = []
+    def report(rows, col, rule):
+        problems.append(pd.DataFrame({'report_ID': df.loc[rows, 'report_ID'], 'indicator': indicators[col], 'column': col,
+                                      'rule': rule, 'value': df.loc[rows, col].astype(str)}))
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(E) Infrastructure') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Infrastructure_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Infrastructure_EXT') 
+    converted, currencies = {}, {}
+    for col, question_type in AUM_NUMERIC_TYPES.items():
+        if col not in df.columns:
+            continue
+        if col in AUM_BAND_COLUMNS:
+            converted[col + '_low'], converted[col + '_high'], currencies[col] = utils.parse_range(df[col], question_type)
+            parsed = converted[col + '_low']
+        else:
+            converted[col + '_value'], currencies[col] = utils.parse_numeric(df[col], question_type)
+            parsed = converted[col + '_value']
+        report(df[col].notna() & parsed.isna(), col, 'aum_unparseable')
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(F) Hedge funds') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Hedge_Fund_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Hedge_fund_EXT') 
+    rate = converted.get(FX_RATE_COLUMN + '_value', pd.Series(np.nan, index=df.index))
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(G) Forestry') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Forestry_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Forestry_EXT') 
+    for col, question_type in AUM_NUMERIC_TYPES.items():
+        if col not in currencies or question_type != utils.MONEY_TYPE_PRI:
+            continue
+        value, currency = converted[col + '_value'], currencies[col]
+        usd = (currency == 'USD') | (currency.isna() & rate.isna())
+        converted[col + '_USD'] = value.where(usd, value * rate)
+        report(value.notna() & converted[col + '_USD'].isna(), col, 'aum_no_fx_rate')
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(I) Other') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Other_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Other_EXT') 
+    df = df.assign(**converted)
+    problems = pd.concat(problems, ignore_index=True) if problems else\
+        pd.DataFrame(columns=['report_ID', 'indicator', 'column', 'rule', 'value'])
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Text') & (df_oo5['sub_question_text'] == '(I) Other - (1) Percentage of Internally managed AUM - Specify:') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Other_details_INT')   
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Text') & (df_oo5['sub_question_text'] == '(I) Other - (2) Percentage of Externally managed AUM - Specify:') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Other_details_EXT')   
+    return df, problems
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Percentage') & (df_oo5['sub_question_text'] == '(J) Off-balance sheet') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Off_balance_INT')     
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_2)], public_response, 'OO5_AUM_PCT_Off_balance_EXT') 
+def log_aum_problems(problems, report_file=None):
 
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Text') & (df_oo5['sub_question_text'] == '(J) Off-balance sheet - (1) Percentage of Internally managed AUM - Specify:') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Off_balance_details_INT')   
-    df_temp = df_oo5[(df_oo5['question_type_pri'] == 'Text') & (df_oo5['sub_question_text'] == '(J) Off-balance sheet - (2) Percentage of Externally managed AUM - Specify:') ]
-    df = utils.merge_and_rename_column(df, df_temp[(df_temp['sub_sub_question_text'] == sub_sub_question_1)], public_response, 'OO5_AUM_PCT_Off_balance_details_EXT')   
+    if not problems.empty:
+        logging.error(f"AUM values that could not be converted for {problems['report_ID'].nunique()} signatories:\n{problems.to_string(index=False)}")
 
-    # OO 6
-    df = utils.merge_and_rename_column(df, df_oo6, public_response, 'OO6_AUM_PCT_subsidiaries_PRI_signatory')   
-    
-    # OO 7
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(A) Listed equity')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Listed_Equity_Emerging_mkt')     
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(B) Fixed income – SSA')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Fixed_Income_SSA_Emerging_mkt')     
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(C) Fixed income – corporate')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Fixed_Income_Corp_Emerging_mkt')    
+    if report_file is not None:
+        validation.write_report(problems, validation.summarize(problems), report_file)
 
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(D) Fixed income – securitised')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Fixed_Income_Securities_Emerging_mkt')     
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(E) Fixed income – private debt')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Fixed_Income_Private_Debt_Emerging_mkt')     
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(F) Private equity')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Private_Equity_Emerging_mkt')   
+# Indicators folded into the signatory profile and dropped from the response table
+ENRICHMENT_INDICATORS = ['OO 2', 'OO 2.1', 'OO 2.2', 'OO 3', 'OO 4', 'OO 5', 'OO 6', 'OO 7']
 
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(G) Real estate')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Real_State_Emerging_mkt')     
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(H) Infrastructure')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Infra_Emerging_mkt')     
-    df = utils.merge_and_rename_column(df, df_oo7[(df_oo7['sub_question_text'] == '(I) Hedge funds')], 'sub_sub_sub_question_text', 'OO7_AUM_PCT_Hedge_Funds_Emerging_mkt')   
+def enrich_signatory_profile(df_signatory, index, aum_problems_file=None):
 
-    # OO 8
+    df_signatory = add_subsidiaries_data(df_signatory,\
+                                        index.frame('OO 2', response_answer='Selected'),\
+                                        index.frame('OO 2.1', response_answer='Selected'),\
+                                        index.frame('OO 2.2', response_answer='Selected') )
 
-    return df
+    df_signatory = add_fundraising_data( df_signatory, index.frame('OO 3', response_answer='Selected') )
 
-def loading_overview(filename=OO_file):
-    logging.info('Starting to load data from OO file')
+    df_signatory = add_aum_data( df_signatory,\
+                                 index.frame('OO 4', response_answer='Selected'),\
+                                 index.frame('OO 5', response_answer='Selected'),\
+                                 index.frame('OO 6', response_answer='Selected'),\
+                                 index.frame('OO 7', response_answer='Selected') )
+
+    df_signatory, problems = convert_aum_data(df_signatory)
+    log_aum_problems(problems, aum_problems_file)
+
+    return df_signatory
+
+def process_overview(df, report, violations_file=None, writer=None, aum_problems_file=None):
+    """
+    Run the stages of the overview pipeline on a loaded export.
 
-    df = utils.load_CSV(filename, encoding='ISO-8859-1')
+    Parameters:
+    df (pd.DataFrame): The export, as loaded by utils.load_csv.
+    report (instrumentation.RunReport): The report the stages are measured in.
+    violations_file (str): The path of the Parquet report of the format violations, see validation.write_report. Default is None, no report.
+    writer (writers.OutputWriter): The writer the signatory profile is queued to as soon as it is complete, so its
+                                   export overlaps with the cleanup of the responses. Default is None, not written.
+    aum_problems_file (str): The path of the Parquet report of the AUM values that could not be converted, see convert_aum_data. Default is None, no report.
 
-    df_form = utils.extract_form(df)
+    Returns:
+    pd.DataFrame: The signatory profile.
+    pd.DataFrame: The cleaned and pre-processed response table.
+    pd.DataFrame: The question dictionary, with the questions of the cleaned texts.
+    """
+
+    df = report.run('set_question_id', utils.set_question_id, df)
+
+    df_form = report.run('extract_form', utils.extract_form, df)
+
+    index = report.run('index', utils.ResponseIndex, df)
    
-    df_signatory = utils.build_signatory_profile(df[df['indicator'] == 'OO 1'])
-    df = df[df['indicator'] != 'OO 1']
+    df_signatory = report.run('build_signatory_profile', utils.build_signatory_profile, index.frame('OO 1'))
+    df = index.exclude(['OO 1'])
 
-    df = utils.set_report_ID(df, df_signatory)
+    df = report.run('set_report_id', utils.set_report_id, df, df_signatory)
 
-    df_signatory = add_subsidiaries_data(df_signatory,\
-                                        df[(df['indicator'] == 'OO 2') & (df['response_answer'] == 'Selected')],\
-                                        df[(df['indicator'] == 'OO 2.1') & (df['response_answer'] == 'Selected')],\
-                                        df[(df['indicator'] == 'OO 2.2') & (df['response_answer'] == 'Selected')] )
+    index = report.run('index', utils.ResponseIndex, df)
+
+    df_signatory = report.run('enrich_signatory_profile', enrich_signatory_profile, df_signatory, index, aum_problems_file)
+
+    if writer is not None:
+        writer.write('signatory', df_signatory)
+
+    df = index.exclude(ENRICHMENT_INDICATORS)
+
+    df = report.run('data_cleanup', data_cleanup, df)
+
+    # Cleaned question texts get their own IDs, add them to the dictionary
+    df = report.run('set_question_id', utils.set_question_id, df)
+    df_form = utils.concat_categorical([df_form, report.run('extract_form', utils.extract_form, df)]).drop_duplicates(subset='question_id')
+
+    df = report.run('check_format', check_format, df, violations_file)
+    df = report.run('pre_processing', pre_processing, df)
+
+    return df_signatory, df, df_form
+
+def write_overview(writer, df_signatory, df, df_form, report, store_file=None):
+
+    # The signatory profile is queued by the caller, as early as it can
+    writer.write('questions', df_form)
+    if writer.writes('facts'):
+        writer.write('facts', report.run('build_fact_table', utils.build_fact_table, df))
+    writer.write('test', df)
+
+    if store_file:
+        with report.stage('publish'):
+            store.publish(store_file, df_signatory, df)
+
+    with report.stage('write'):
+        writer.close()
+
+def loading_overview(filename=OO_file, output_dir=OUTPUT_DIR, output_format='csv', partition_by=None, compression=None, report_file=None,\
+                     store_file=None, violations_file=None, tables=None, aum_problems_file=None):
+    logging.info('Starting to load data from OO file')
+
+    report = instrumentation.RunReport(filename)
+    writer = writers.OutputWriter(output_dir, output_format, partition_by, compression, tables)
+
+    df = report.run('load_csv', utils.load_csv_cached, filename, encoding='ISO-8859-1')
+
+    df_signatory, df, df_form = process_overview(df, report, violations_file, writer, aum_problems_file)
+
+    write_overview(writer, df_signatory, df, df_form, report, store_file)
+
+    instrumentation.log_report(report)
+    if report_file:
+        report.write(report_file)
+
+    logging.info('Overview complete')
+
+    return df_signatory
+
+def _export_ids(df_responses, df):
+
+    # The unchanged signatories have the same rows in the same order, but the EXPORT_ID_COLUMNS are not
+    # hashed and may have moved, take them from the export by the position of the row in its signatory
+    df_export = utils.ResponseIndex(df).exclude(['OO 1'] + ENRICHMENT_INDICATORS)
+    keys = utils.signatory_key(df_export).to_numpy()
+    ids = df_export[utils.EXPORT_ID_COLUMNS].set_axis(pd.MultiIndex.from_arrays([keys, pd.Series(keys).groupby(keys).cumcount().to_numpy()]))
+
+    rows = pd.MultiIndex.from_arrays([df_responses['report_ID'].to_numpy(), df_responses.groupby('report_ID').cumcount().to_numpy()])
+    df_responses = df_responses.copy()
+    for col in utils.EXPORT_ID_COLUMNS:
+        df_responses[col] = ids[col].reindex(rows).to_numpy()
+
+    return df_responses
+
+# Tables of the incremental state, kept as pickles so their dtypes survive between runs
+STATE_TABLES = ['version', 'content_hash', 'signatory', 'responses', 'questions']
+
+def state_version(rules_file=CLEANUP_RULES_FILE):
+    """
+    Hash the code and settings the stored tables were produced with: the source of the overview,
+    utils and validation modules, with their column specs and patterns, the cleanup rules and the loader schema.
+
+    Parameters:
+    rules_file (str): The path to the cleanup rules. Default is CLEANUP_RULES_FILE.
+
+    Returns:
+    str: A hexadecimal version, stored with the state of an incremental run.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for module in (sys.modules[__name__], utils, validation):
+        h.update(inspect.getsource(module).encode())
+    h.update(utils.load_cleanup_rules(rules_file).to_csv(index=False).encode())
+    h.update(f'{utils.LOADER_SCHEMA_VERSION}|{sorted(utils.CSV_SCHEMA.items())}'.encode())
+
+    return h.hexdigest()
+
+def load_state(state_dir):
+    """
+    Load the state of the previous incremental run.
+
+    Parameters:
+    state_dir (str): The directory of the state.
+
+    Returns:
+    dict: The STATE_TABLES by name, or None when the state is missing or incomplete.
+    """
+
+    files = {name: os.path.join(state_dir, name + '.pkl') for name in STATE_TABLES}
+    if not all(os.path.exists(file) for file in files.values()):
+        return None
+
+    return {name: pd.read_pickle(file) for name, file in files.items()}
+
+def save_state(state_dir, state):
+    """
+    Save the state of an incremental run, replacing every table atomically.
+
+    Parameters:
+    state_dir (str): The directory of the state.
+    state (dict): The STATE_TABLES by name.
+    """
+
+    os.makedirs(state_dir, exist_ok=True)
+    for name in STATE_TABLES:
+        file = os.path.join(state_dir, name + '.pkl')
+        pd.to_pickle(state[name], file + '.tmp')
+        os.replace(file + '.tmp', file)
+
+def loading_overview_incremental(filename=OO_file, output_dir=OUTPUT_DIR, output_format='csv', partition_by=None, compression=None,\
+                                 state_dir=None, report_file=None, store_file=None, violations_file=None, tables=None, aum_problems_file=None):
+    """
+    Run the overview pipeline only for the signatories that changed since the previous run.
+
+    The rows of every signatory are hashed and compared with the hashes stored by the previous
+    run, see utils.signatory_content_hash. Only the added and changed signatories go through the
+    pipeline, their rows replace the ones of the stored signatory profile and response table, and
+    the removed signatories are dropped. The stored rows take the UID and Column2 of the export. The outputs are then rewritten from the patched tables. Without a stored state,
+    e.g. on the first run, or when the code or the cleanup rules changed since the state was
+    stored, see state_version, every signatory is processed.
+
+    The patched tables hold the same rows as a full run, the rows of the changed signatories
+    come last. The question dictionary keeps the questions of removed signatories.
     
+    Parameters:
+    filename (str): The path to the OO export.
+    output_dir (str): The directory the tables are written to. Default is OUTPUT_DIR.
+    output_format (str): The format of the tables, see writers.OUTPUT_FORMATS. Default is 'csv'.
+    partition_by (str): Column the Parquet tables are partitioned by. Default is None.
+    compression (str): Compression of the CSV files. Default is None.
+    state_dir (str): The directory of the stored state. Default is '.overview_state' in output_dir.
+    report_file (str): The path of the JSON run report. Default is None, no report.
+    store_file (str): The path of the SQLite store the patched tables are published to, see store.publish. Default is None, no store.
+    violations_file (str): The path of the Parquet report of the format violations of the processed signatories. Default is None, no report.
+    tables (list): The tables written, see writers.OutputWriter. Default is None, every table.
+    aum_problems_file (str): The path of the Parquet report of the AUM values of the processed signatories that could not be converted. Default is None, no report.
+
+    Returns:
+    pd.DataFrame: The signatory profile.
+    """
+
+    logging.info('Starting to load data from OO file incrementally')
+
+    if state_dir is None:
+        state_dir = os.path.join(output_dir, '.overview_state')
+
+    report = instrumentation.RunReport(filename)
+    writer = writers.OutputWriter(output_dir, output_format, partition_by, compression, tables)
+
+    df = report.run('load_csv', utils.load_csv_cached, filename, encoding='ISO-8859-1')
+
+    content_hash = report.run('content_hash', utils.signatory_content_hash, df)
+    version = state_version()
+
+    state = load_state(state_dir)
+    if state is None:
+        logging.info('No previous state in ' + state_dir + ', processing every signatory')
+    elif state['version'] != version:
+        logging.info('The code or the cleanup rules changed since the previous run, processing every signatory')
+        state = None
+
+    previous = content_hash.iloc[:0] if state is None else state['content_hash']
+
+    # Compare the hashes as uint64, aligning them with reindex would turn them into floats
+    common = content_hash.index.intersection(previous.index)
+    unchanged = common[content_hash[common].to_numpy() == previous[common].to_numpy()]
+    changed = content_hash.index.difference(unchanged)
+    removed = previous.index.difference(content_hash.index)
+    logging.info(f'{len(changed)} signatories added or changed, {len(removed)} removed, {len(unchanged)} unchanged')
+
+    stale = changed.union(removed)
+    signatories, responses, forms = [], [], []
+    if state is not None:
+        signatories.append(state['signatory'][~state['signatory']['report_ID'].isin(stale)])
+        responses.append(report.run('export_ids', _export_ids, state['responses'][~state['responses']['report_ID'].isin(stale)], df))
+        forms.append(state['questions'])
+
+    if len(changed):
+        df = df[utils.signatory_key(df).isin(changed).to_numpy()].reset_index(drop=True)
+        df_signatory, df_responses, df_form = process_overview(df, report, violations_file, aum_problems_file=aum_problems_file)
+        signatories.append(df_signatory)
+        responses.append(df_responses)
+        forms.append(df_form)
+
+    df_signatory = utils.concat_categorical(signatories)
+    df_responses = utils.concat_categorical(responses)
+    df_form = utils.concat_categorical(forms).drop_duplicates(subset='question_id')
+
+    writer.write('signatory', df_signatory)
+    write_overview(writer, df_signatory, df_responses, df_form, report, store_file)
+
+    with report.stage('save_state'):
+        save_state(state_dir, {'version': version, 'content_hash': content_hash, 'signatory': df_signatory, 'responses': df_responses,\
+                               'questions': df_form})
+
+    instrumentation.log_report(report)
+    if report_file:
+        report.write(report_file)
+
+    logging.info('Overview complete')
+
+    return df_signatory
+
+def loading_overview_streaming(filename=OO_file, output_dir=OUTPUT_DIR, output_format='csv', partition_by=None, compression=None,\
+                               chunk_size=100000, spill_dir=None, report_file=None, violations_file=None, tables=None, aum_problems_file=None):
+    """
+    Run the overview pipeline chunk by chunk in a bounded amount of memory.
+
+    The first pass keeps only the 'OO 1' rows and the 'Selected' rows of the enrichment
+    indicators in memory, and spills the rest of the response table chunk by chunk to
+    temporary files. Once the signatory profile is built, the second pass assigns the
+    report IDs, cleans, checks and splits each spilled chunk and appends it to the output.
+    The outputs are identical to the ones of loading_overview.
     
+    Parameters:
+    filename (str): The path to the OO export.
+    output_dir (str): The directory the tables are written to. Default is OUTPUT_DIR.
+    output_format (str): The format of the tables, see writers.OUTPUT_FORMATS. Default is 'csv'.
+    partition_by (str): Column the Parquet tables are partitioned by. Default is None.
+    compression (str): Compression of the CSV files. Default is None.
+    chunk_size (int): The number of rows per chunk. Default is 100000.
+    spill_dir (str): The directory of the temporary spill files. Default is the system temporary directory.
+    report_file (str): The path of the JSON run report, see instrumentation.RunReport. Default is None, no report.
+    violations_file (str): The path of the Parquet report of the format violations, see validation.write_report. Default is None, no report.
+    tables (list): The tables written, see writers.OutputWriter. Default is None, every table.
+    aum_problems_file (str): The path of the Parquet report of the AUM values that could not be converted, see convert_aum_data. Default is None, no report.
 
-    df_signatory = add_fundraising_data( df_signatory, df[(df['indicator'] == 'OO 3') & (df['response_answer'] == 'Selected')] )
+    Returns:
+    pd.DataFrame: The signatory profile.
+    """
 
-    df_signatory = add_aum_data( df_signatory,\
-                                 df[(df['indicator'] == 'OO 4') & (df['response_answer'] == 'Selected')],\
-                                 df[(df['indicator'] == 'OO 5') & (df['response_answer'] == 'Selected')],\
-                                 df[(df['indicator'] == 'OO 6') & (df['response_answer'] == 'Selected')],\
-                                 df[(df['indicator'] == 'OO 7') & (df['response_answer'] == 'Selected')] )
+    logging.info('Starting to stream data from OO file')
 
-    df = df[~df['indicator'].isin(['OO 2', 'OO 2.1', 'OO 2.2', 'OO 3', 'OO 4', 'OO 5', 'OO 6', 'OO 7'])]
+    report = instrumentation.RunReport(filename)
+    writer = writers.OutputWriter(output_dir, output_format, partition_by, compression, tables)
 
-    logging.info('Exporting signatory data to CSV')
-    df_signatory.to_csv('/home/lngo/projects/Joe/signatory.csv', index=False)
+    forms, oo1_chunks, enrichment_chunks, spill_files = [], [], [], []
 
-    df = data_cleanup(df)
-    df = check_format(df)
-    df = pre_processing(df)
-    
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+
+        chunks = utils.iter_csv(filename, chunk_size, encoding='ISO-8859-1')
+        while True:
+            with report.stage('load_csv') as stage:
+                chunk = stage.output(next(chunks, None))
+            if chunk is None:
+                break
+
+            chunk = report.run('set_question_id', utils.set_question_id, chunk)
+            index = report.run('index', utils.ResponseIndex, chunk)
+
+            forms.append(report.run('extract_form', utils.extract_form, chunk))
+            oo1_chunks.append(index.frame('OO 1'))
+            enrichment_chunks += [index.frame(indicator, response_answer='Selected') for indicator in ENRICHMENT_INDICATORS]
+
+            spill_file = os.path.join(tmp_dir, f'chunk_{len(spill_files):05d}.pkl')
+            with report.stage('spill') as stage:
+                stage.output(index.exclude(['OO 1'] + ENRICHMENT_INDICATORS)).to_pickle(spill_file)
+            spill_files.append(spill_file)
 
-    df_form.to_csv('/home/lngo/projects/Joe/questions.csv', index=False)
-    df.to_csv('/home/lngo/projects/Joe/test.csv', index=False)
+        # The chunks have their own categories, keep the categorical dtypes of the in-memory path
+        df_signatory = report.run('build_signatory_profile', utils.build_signatory_profile, utils.concat_categorical(oo1_chunks))
+
+        df_enrichment = report.run('set_report_id', utils.set_report_id, utils.concat_categorical(enrichment_chunks), df_signatory)
+        df_signatory = report.run('enrich_signatory_profile', enrich_signatory_profile, df_signatory, utils.ResponseIndex(df_enrichment), aum_problems_file)
+
+        writer.write('signatory', df_signatory)
+
+        rules = utils.load_cleanup_rules(CLEANUP_RULES_FILE)
+        rows_touched = 0
+        violations = validation.ReportWriter(violations_file)
+        cleaned_forms = []
+        offset = 0
+
+        for i, spill_file in enumerate(spill_files):
+            df = report.run('read_spill', pd.read_pickle, spill_file)
+            df = report.run('set_report_id', utils.set_report_id, df, df_signatory)
+            df.index += offset
+            offset += len(df)
+
+            df, cleanup = report.run('data_cleanup', utils.apply_cleanup_rules, df, rules)
+            rows_touched = rows_touched + cleanup['rows_touched']
+
+            df = report.run('set_question_id', utils.set_question_id, df)
+            cleaned_forms.append(report.run('extract_form', utils.extract_form, df))
+
+            violations.append(report.run('check_format', validation.run_checks, df)[0])
+
+            df = report.run('pre_processing', pre_processing, df)
+
+            if writer.writes('facts'):
+                writer.append('facts', report.run('build_fact_table', utils.build_fact_table, df))
+            writer.append('test', df)
+
+    _log_cleanup(rules.assign(rows_touched=rows_touched))
+
+    log_format(violations.close())
+
+    df_form = utils.concat_categorical(forms + cleaned_forms).drop_duplicates(subset='question_id')
+    writer.write('questions', df_form)
+    with report.stage('write'):
+        writer.close()
+
+    instrumentation.log_report(report)
+    if report_file:
+        report.write(report_file)
 
     logging.info('Overview complete')
 
+    return df_signatory
+
 if __name__ == '__main__':
     logging.basicConfig( level=logging.INFO)
 
+    parser = argparse.ArgumentParser(description='Run the overview pipeline on a PRI OO export.')
+    parser.add_argument('filename', nargs='?', default=OO_file, help='path of the OO export')
+    parser.add_argument('--output', default=OUTPUT_DIR, help='directory the tables are written to')
+    parser.add_argument('--format', default='csv', choices=writers.OUTPUT_FORMATS, help='format of the tables')
+    parser.add_argument('--partition-by', default=None, help='column the parquet tables are partitioned by, e.g. indicator')
+    parser.add_argument('--compression', default=None, choices=list(writers.COMPRESSION_EXTENSIONS), help='compression of the csv files')
+    parser.add_argument('--stream', action='store_true', help='process the export in bounded memory')
+    parser.add_argument('--incremental', action='store_true', help='only process the signatories that changed since the previous run')
+    parser.add_argument('--report', default=None, help='path of the JSON run report with the timings of every stage')
+    parser.add_argument('--store', default=None, help='path of an SQLite store to publish the signatory and response tables to')
+    parser.add_argument('--violations', default=None, help='path of the Parquet report of the format violations')
+    parser.add_argument('--aum-problems', default=None, help='path of the Parquet report of the AUM values that could not be converted')
+    parser.add_argument('--tables', nargs='+', default=None, choices=writers.OUTPUT_TABLES, help='tables to write, e.g. signatory questions facts to skip the full-text test table')
+    args = parser.parse_args()
+
     logging.info('starting from this file')
-    loading_overview()
\ No newline at end of file
+    if args.incremental:
+        loading_overview_incremental(args.filename, args.output, args.format, args.partition_by, args.compression, report_file=args.report,\
+                                     store_file=args.store, violations_file=args.violations, tables=args.tables,\
+                                     aum_problems_file=args.aum_problems)
+    elif args.stream:
+        if args.store:
+            logging.error('The store is not published in streaming mode, run store.publish on the exported tables')
+        loading_overview_streaming(args.filename, args.output, args.format, args.partition_by, args.compression, report_file=args.report,\
+                                   violations_file=args.violations, tables=args.tables, aum_problems_file=args.aum_problems)
+    else:
+        loading_overview(args.filename, args.output, args.format, args.partition_by, args.compression, report_file=args.report,\
+                         store_file=args.store, violations_file=args.violations, tables=args.tables, aum_problems_file=args.aum_problems)
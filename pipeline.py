@@ -0,0 +1,323 @@
+import os, sys, glob, json, hashlib, inspect, logging, argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+
+import instrumentation
+import overview
+import store
+import utils
+import validation
+import writers
+
+
+class Stage:
+    """
+    A stage of the pipeline graph.
+
+    Parameters:
+    name (str): The name of the stage, also the name of its cached output.
+    func (callable): Called with the outputs of the input stages, in order. It must not modify them.
+    inputs (list): The names of the input stages.
+    config (callable): Returns the settings the output depends on besides the inputs and the code, e.g. a rule table. Default is None.
+    code (list): The modules whose source is part of the cache key, with the helpers and module-level constants
+                 the stage reads, func is always included. Default is None.
+    """
+
+    def __init__(self, name, func, inputs, config=None, code=None):
+
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.config = config
+        self.code = [func] + (code or [])
+
+def _fingerprint(obj):
+
+    # Tables are hashed through their CSV text, which holds every value unlike their repr
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_csv(index=False)
+    if isinstance(obj, dict):
+        return {str(key): _fingerprint(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_fingerprint(value) for value in obj]
+
+    return repr(obj)
+
+def _responses(df):
+
+    return utils.set_question_id(df.copy())
+
+def _signatory_base(df):
+
+    return utils.build_signatory_profile(utils.ResponseIndex(df).frame('OO 1'))
+
+def _linked(df, df_signatory):
+
+    return utils.set_report_id(utils.ResponseIndex(df).exclude(['OO 1']), df_signatory)
+
+def _signatory(df_signatory, df):
+
+    return overview.enrich_signatory_profile(df_signatory, utils.ResponseIndex(df))
+
+def _aum_problems(df_signatory):
+
+    # The profile keeps the AUM responses as answered, converting them again finds the same problems
+    return overview.convert_aum_data(df_signatory)[1]
+
+def _cleaned(df):
+
+    df = overview.data_cleanup(utils.ResponseIndex(df).exclude(overview.ENRICHMENT_INDICATORS), rules_file=overview.CLEANUP_RULES_FILE)
+
+    # Cleaned question texts get their own IDs
+    return utils.set_question_id(df)
+
+def _questions(df_form, df):
+
+    # concat_categorical recodes its frames, keep the result of the 'form' stage as it was cached
+    return utils.concat_categorical([df_form.copy(deep=False), utils.extract_form(df)]).drop_duplicates(subset='question_id')
+
+def _validation(df):
+
+    violations, summary = validation.run_checks(df)
+    overview.log_format(summary)
+
+    return violations
+
+def _processed(df):
+
+    return overview.pre_processing(df.copy())
+
+# The overview pipeline, 'export' is the source file. The signatory enrichment and the cleanup of the
+# response table only share their inputs, so they run concurrently
+STAGES = [
+    Stage('responses', _responses, ['export'], code=[utils]),
+    Stage('form', utils.extract_form, ['responses'], code=[utils]),
+    Stage('signatory_base', _signatory_base, ['responses'], code=[utils]),
+    Stage('linked', _linked, ['responses', 'signatory_base'], code=[utils]),
+    Stage('signatory', _signatory, ['signatory_base', 'linked'], code=[overview, utils]),
+    Stage('aum_problems', _aum_problems, ['signatory'], code=[overview, utils]),
+    Stage('cleaned', _cleaned, ['linked'], config=lambda: utils.load_cleanup_rules(overview.CLEANUP_RULES_FILE), code=[overview, utils]),
+    Stage('questions', _questions, ['form', 'cleaned'], code=[utils]),
+    Stage('validation', _validation, ['cleaned'], code=[validation, overview, utils]),
+    Stage('processed', _processed, ['cleaned'], code=[overview]),
+    Stage('facts', utils.build_fact_table, ['processed'], code=[utils]),
+]
+
+# Tables written by run_pipeline, by stage
+OUTPUT_TABLES = {'signatory': 'signatory', 'questions': 'questions', 'facts': 'facts', 'processed': 'test'}
+
+class Pipeline:
+    """
+    Run a graph of stages, caching the output of every stage on disk.
+
+    The cache key of a stage is a hash of the keys of its inputs, its config and the source of its
+    function and modules, and the key of the source file is its utils.file_fingerprint. Editing a
+    module reruns every stage reading it, even when the edit does not concern that stage. A stage
+    whose key has a cached output is loaded instead of run, and its inputs are not even loaded
+    unless another stage needs them. Stages whose inputs are ready run concurrently in a thread pool.
+    A cached stage does not repeat the logging of its run.
+
+    Parameters:
+    filename (str): The path to the OO export.
+    cache_dir (str): The directory of the cached outputs.
+    stages (list): The Stage objects. Default is STAGES.
+    encoding (str): The encoding of the export. Default is 'ISO-8859-1'.
+    workers (int): The number of stages run at the same time. Default is 2.
+    report (instrumentation.RunReport): The report the stages are measured in. Default is a new one.
+    """
+
+    def __init__(self, filename, cache_dir, stages=STAGES, encoding='ISO-8859-1', workers=2, report=None):
+
+        self.filename = filename
+        self.cache_dir = cache_dir
+        self.stages = {stage.name: stage for stage in stages}
+        self.encoding = encoding
+        self.workers = workers
+        self.report = report or instrumentation.RunReport(filename)
+
+        self.stages['export'] = Stage('export', self._load, [], code=[utils])
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _load(self):
+
+        return utils.load_csv(self.filename, encoding=self.encoding)
+
+    def keys(self):
+        """
+        Compute the cache key of every stage.
+
+        Returns:
+        dict: The hexadecimal key of every stage.
+        """
+
+        keys = {}
+        def key(name):
+            if name not in keys:
+                stage = self.stages[name]
+                h = hashlib.blake2b(digest_size=16)
+                h.update(name.encode())
+                h.update(json.dumps(_fingerprint(stage.config() if stage.config else None)).encode())
+                for func in stage.code:
+                    h.update(inspect.getsource(func).encode())
+                for input_name in stage.inputs:
+                    h.update(key(input_name).encode())
+                if name == 'export':
+                    h.update(utils.file_fingerprint(self.filename, encoding=self.encoding).encode())
+                keys[name] = h.hexdigest()
+            return keys[name]
+
+        for name in self.stages:
+            key(name)
+
+        return keys
+
+    def _cache_file(self, name, key):
+
+        return os.path.join(self.cache_dir, f'{name}.{key}.pkl')
+
+    def _run_stage(self, name, key, inputs):
+
+        with self.report.stage(name, *inputs) as stage:
+            result = stage.output(self.stages[name].func(*inputs))
+
+        cache_file = self._cache_file(name, key)
+        for stale_file in glob.glob(os.path.join(glob.escape(self.cache_dir), glob.escape(name) + '.*.pkl')):
+            if stale_file != cache_file:
+                os.remove(stale_file)
+
+        # Write under a temporary name so an interrupted run never leaves a truncated output behind
+        pd.to_pickle(result, cache_file + '.tmp')
+        os.replace(cache_file + '.tmp', cache_file)
+
+        return result
+
+    def _load_stage(self, name, key):
+
+        with self.report.stage(name + ' (cached)') as stage:
+            return stage.output(pd.read_pickle(self._cache_file(name, key)))
+
+    def run(self, targets):
+        """
+        Compute the outputs of the target stages, running only the stages without a cached output.
+
+        Parameters:
+        targets (list): The names of the stages to return.
+
+        Returns:
+        dict: The output of every target stage.
+        """
+
+        keys = self.keys()
+
+        # Walk up from the targets, stopping at the stages with a cached output
+        plan, cached = {}, set()
+        def visit(name):
+            if name in plan:
+                return
+            if os.path.exists(self._cache_file(name, keys[name])):
+                cached.add(name)
+            plan[name] = [] if name in cached else self.stages[name].inputs
+            for input_name in plan[name]:
+                visit(input_name)
+
+        for name in targets:
+            visit(name)
+
+        logging.info(f'Running {len(plan) - len(cached)} stages, loading {len(cached)} cached outputs')
+
+        results = {}
+        pending = set(plan)
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or futures:
+                for name in sorted(pending):
+                    if all(input_name in results for input_name in plan[name]):
+                        pending.remove(name)
+                        if name in cached:
+                            futures[executor.submit(self._load_stage, name, keys[name])] = name
+                        else:
+                            futures[executor.submit(self._run_stage, name, keys[name], [results[input_name] for input_name in plan[name]])] = name
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures.pop(future)] = future.result()
+
+        return {name: results[name] for name in targets}
+
+def run_pipeline(filename=overview.OO_file, output_dir=overview.OUTPUT_DIR, output_format='csv', partition_by=None, compression=None,\
+                 cache_dir=None, workers=2, report_file=None, store_file=None, violations_file=None, tables=None, aum_problems_file=None):
+    """
+    Run the overview pipeline as a graph of cached stages and write its tables.
+
+    Parameters:
+    filename (str): The path to the OO export.
+    output_dir (str): The directory the tables are written to. Default is overview.OUTPUT_DIR.
+    output_format (str): The format of the tables, see writers.OUTPUT_FORMATS. Default is 'csv'.
+    partition_by (str): Column the Parquet tables are partitioned by. Default is None.
+    compression (str): Compression of the CSV files. Default is None.
+    cache_dir (str): The directory of the cached stage outputs. Default is '.overview_cache' in output_dir.
+    workers (int): The number of stages run at the same time. Default is 2.
+    report_file (str): The path of the JSON run report. Default is None, no report.
+    store_file (str): The path of the SQLite store the tables are published to, see store.publish. Default is None, no store.
+    violations_file (str): The path of the Parquet report of the format violations, see validation.write_report. Default is None, no report.
+    tables (list): The tables written, see writers.OutputWriter. Default is None, every table.
+    aum_problems_file (str): The path of the Parquet report of the AUM values that could not be converted, see overview.convert_aum_data. Default is None, no report.
+
+    Returns:
+    pd.DataFrame: The signatory profile.
+    """
+
+    logging.info('Starting the overview pipeline')
+
+    if cache_dir is None:
+        cache_dir = os.path.join(output_dir, '.overview_cache')
+
+    report = instrumentation.RunReport(filename)
+    pipeline = Pipeline(filename, cache_dir, workers=workers, report=report)
+    results = pipeline.run(list(OUTPUT_TABLES) + ['validation'] + (['aum_problems'] if aum_problems_file else []))
+
+    if violations_file:
+        validation.write_report(results['validation'], validation.summarize(results['validation']), violations_file)
+    if aum_problems_file:
+        validation.write_report(results['aum_problems'], validation.summarize(results['aum_problems']), aum_problems_file)
+
+    with writers.OutputWriter(output_dir, output_format, partition_by, compression, tables) as writer:
+        for stage, table in OUTPUT_TABLES.items():
+            writer.write(table, results[stage])
+
+        if store_file:
+            with report.stage('publish'):
+                store.publish(store_file, results['signatory'], results['processed'])
+
+    instrumentation.log_report(report)
+    if report_file:
+        report.write(report_file)
+
+    logging.info('Overview complete')
+
+    return results['signatory']
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Run the overview pipeline as a graph of cached stages.')
+    parser.add_argument('filename', nargs='?', default=overview.OO_file, help='path of the OO export')
+    parser.add_argument('--output', default=overview.OUTPUT_DIR, help='directory the tables are written to')
+    parser.add_argument('--format', default='csv', choices=writers.OUTPUT_FORMATS, help='format of the tables')
+    parser.add_argument('--partition-by', default=None, help='column the parquet tables are partitioned by, e.g. indicator')
+    parser.add_argument('--compression', default=None, choices=list(writers.COMPRESSION_EXTENSIONS), help='compression of the csv files')
+    parser.add_argument('--cache-dir', default=None, help='directory of the cached stage outputs')
+    parser.add_argument('--workers', type=int, default=2, help='number of stages run at the same time')
+    parser.add_argument('--report', default=None, help='path of the JSON run report with the timings of every stage')
+    parser.add_argument('--store', default=None, help='path of an SQLite store to publish the signatory and response tables to')
+    parser.add_argument('--violations', default=None, help='path of the Parquet report of the format violations')
+    parser.add_argument('--aum-problems', default=None, help='path of the Parquet report of the AUM values that could not be converted')
+    parser.add_argument('--tables', nargs='+', default=None, choices=writers.OUTPUT_TABLES, help='tables to write, e.g. signatory questions facts to skip the full-text test table')
+    args = parser.parse_args()
+
+    run_pipeline(args.filename, args.output, args.format, args.partition_by, args.compression, args.cache_dir, args.workers, args.report, args.store,\
+                 args.violations, args.tables, args.aum_problems)
+
+    sys.exit(0)
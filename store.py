@@ -0,0 +1,197 @@
+import os, sys, sqlite3, logging, argparse
+import pandas as pd
+
+
+# Tables of the store and the columns they are indexed on
+STORE_INDEXES = {'signatory': ['report_ID', 'region', 'aum_band', 'signatory_category'],
+                 'responses': ['report_ID', 'indicator', 'region', 'aum_band', 'signatory_category']}
+
+# Filters of the query methods, column name by keyword argument
+QUERY_FILTERS = {'report_id': 'report_ID', 'indicator': 'indicator', 'region': 'region', 'aum_band': 'aum_band',\
+                 'signatory_category': 'signatory_category'}
+
+def _quote(name):
+
+    return '"' + name.replace('"', '""') + '"'
+
+def publish(db_file, df_signatory, df_responses):
+    """
+    Write the signatory profile and the cleaned response table to an SQLite store with the STORE_INDEXES.
+
+    The store is built under a temporary name and replaces the previous one at once, so readers
+    never see a partial store.
+
+    Parameters:
+    db_file (str): The path of the SQLite file.
+    df_signatory (pd.DataFrame): The signatory profile.
+    df_responses (pd.DataFrame): The cleaned response table.
+    """
+
+    logging.info('Publishing the store ' + db_file)
+
+    tmp_file = db_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    tables = {'signatory': df_signatory, 'responses': df_responses}
+
+    with sqlite3.connect(tmp_file) as con:
+        for name, df in tables.items():
+            df.to_sql(name, con, index=False, chunksize=100000)
+            for col in STORE_INDEXES[name]:
+                if col in df.columns:
+                    con.execute(f'CREATE INDEX {_quote("ix_" + name + "_" + col)} ON {_quote(name)} ({_quote(col)})')
+
+        # Dtypes SQLite does not keep, restored by QueryStore
+        dtypes = [(name, col, str(dtype)) for name, df in tables.items() for col, dtype in df.dtypes.items()\
+                  if pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)]
+        pd.DataFrame(dtypes, columns=['table_name', 'column_name', 'dtype']).to_sql('column_types', con, index=False)
+    con.close()
+
+    os.replace(tmp_file, db_file)
+
+class QueryStore:
+    """
+    Query the SQLite store written by publish, returning DataFrames.
+
+    Every filter takes a value or a list of values, e.g. store.signatories(region='Europe', aum_band=['0-250 US$m']).
+
+    Parameters:
+    db_file (str): The path of the SQLite file.
+    """
+
+    def __init__(self, db_file):
+
+        if not os.path.exists(db_file):
+            raise FileNotFoundError('No store at ' + db_file)
+
+        self.db_file = db_file
+        self._con = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True, check_same_thread=False)
+
+        self._columns = {name: [row[1] for row in self._con.execute(f'PRAGMA table_info({_quote(name)})')] for name in STORE_INDEXES}
+        self._dtypes = pd.read_sql_query('SELECT * FROM column_types', self._con)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+
+        self._con.close()
+
+    def columns(self, table):
+        """
+        Return the columns of a table of the store, 'signatory' or 'responses'.
+        """
+
+        return list(self._columns[table])
+
+    def _select(self, table, columns, filters):
+
+        if columns is None:
+            columns = self._columns[table]
+        unknown = [col for col in columns if col not in self._columns[table]]
+        if unknown:
+            raise KeyError(f'Unknown columns of {table}: {unknown}')
+
+        conditions, params = [], []
+        for keyword, values in filters.items():
+            if values is None:
+                continue
+            values = list(values) if isinstance(values, (list, tuple, set, pd.Series, pd.Index)) else [values]
+            conditions.append(f'{_quote(QUERY_FILTERS[keyword])} IN ({", ".join("?" * len(values))})')
+            params += [int(value) if keyword == 'report_id' else value for value in values]
+
+        query = f'SELECT {", ".join(map(_quote, columns))} FROM {_quote(table)}'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        return self.query(query, params, table)
+
+    def query(self, sql, params=(), table=None):
+        """
+        Run an SQL query on the store.
+
+        Parameters:
+        sql (str): The query, with ? placeholders.
+        params (list): The values of the placeholders. Default is none.
+        table (str): The table whose datetime and boolean columns are restored. Default is None.
+
+        Returns:
+        pd.DataFrame: The result.
+        """
+
+        df = pd.read_sql_query(sql, self._con, params=list(params))
+
+        if table is not None:
+            for col, dtype in self._dtypes.loc[self._dtypes['table_name'] == table, ['column_name', 'dtype']].itertuples(index=False):
+                if col in df.columns:
+                    df[col] = pd.to_datetime(df[col]) if dtype.startswith('datetime') else df[col].astype(dtype)
+
+        return df
+
+    def signatories(self, columns=None, report_id=None, region=None, aum_band=None, signatory_category=None):
+        """
+        Return the signatory profile rows matching every given filter.
+
+        Parameters:
+        columns (list): The columns to return. Default is None, every column.
+        report_id: The report_ID values. Default is None, any.
+        region: The region values. Default is None, any.
+        aum_band: The aum_band values. Default is None, any.
+        signatory_category: The signatory_category values. Default is None, any.
+
+        Returns:
+        pd.DataFrame: The matching signatories.
+        """
+
+        return self._select('signatory', columns, {'report_id': report_id, 'region': region, 'aum_band': aum_band,\
+                                                   'signatory_category': signatory_category})
+
+    def responses(self, columns=None, report_id=None, indicator=None, region=None, aum_band=None, signatory_category=None):
+        """
+        Return the cleaned responses matching every given filter.
+
+        Parameters:
+        columns (list): The columns to return. Default is None, every column.
+        report_id: The report_ID values. Default is None, any.
+        indicator: The indicator values, e.g. 'OO 18'. Default is None, any.
+        region: The region values. Default is None, any.
+        aum_band: The aum_band values. Default is None, any.
+        signatory_category: The signatory_category values. Default is None, any.
+
+        Returns:
+        pd.DataFrame: The matching responses.
+        """
+
+        return self._select('responses', columns, {'report_id': report_id, 'indicator': indicator, 'region': region,\
+                                                   'aum_band': aum_band, 'signatory_category': signatory_category})
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Query the signatory and response store of an overview run.')
+    parser.add_argument('db_file', help='path of the SQLite store')
+    parser.add_argument('table', choices=list(STORE_INDEXES), help='table to query')
+    parser.add_argument('--columns', nargs='+', default=None, help='columns to return')
+    for keyword in QUERY_FILTERS:
+        parser.add_argument('--' + keyword.replace('_', '-'), nargs='+', default=None, dest=keyword)
+    parser.add_argument('--output', default=None, help='write the result to this CSV file instead of printing it')
+    args = parser.parse_args()
+
+    with QueryStore(args.db_file) as store:
+        filters = {keyword: getattr(args, keyword) for keyword in QUERY_FILTERS}
+        if args.table == 'signatory':
+            filters.pop('indicator')
+            df = store.signatories(args.columns, **filters)
+        else:
+            df = store.responses(args.columns, **filters)
+
+    if args.output:
+        df.to_csv(args.output, index=False)
+    else:
+        print(df.to_string(index=False))
+
+    sys.exit(0)
@@ -0,0 +1,185 @@
+import sys, logging, argparse
+import numpy as np
+import pandas as pd
+
+import utils
+import overview
+
+
+# Column layout of the PRI Organisational Overview export
+EXPORT_COLUMNS = ['module_short', 'section', 'subsection', 'indicator', 'Core/Plus', 'question_type_pri', 'question_text',\
+                  'sub_question_text', 'sub_sub_question_text', 'sub_sub_sub_question_text', 'response_group_text',\
+                  'response_answer', ' Signatory_Public_Response ', 'Column2', 'UID'] + utils.SIGNATORY_KEYS
+
+SIGNATORY_CATEGORIES = ['Investment Manager', 'Asset Owner', 'Service Provider']
+AUM_BANDS = ['0-250 US$m', '250-1000 US$m', '1000-10000 US$m', '>10000 US$m']
+COUNTRIES = {'Europe': ['France', 'Germany', 'United Kingdom', 'Netherlands'], 'North America': ['United States of America', 'Canada'],\
+             'Asia': ['Japan', 'Singapore'], 'Oceania': ['Australia']}
+PCT_BANDS = ['0%', '>0-10%', '>10-50%', '>50-75%', '>75%']
+
+# Generic indicators after the ones folded into the signatory profile, with the texts the cleanup rules fix
+CLEANUP_OPTIONS = {'OO 10': ['Stewardship, excluding (proxy) voting', '(B) (Proxy) voting'],
+                   'OO 15': ['Externally managed', 'Internally managed'],
+                   'OO 16': ['Externally managed', 'Internally managed'],
+                   'OO 21': ['Confidence Building Measures', 'Policy, Governance and Strategy']}
+
+def _form(n_indicators, n_options):
+
+    rows = []
+    def add(indicator, question_type, question_text, sub=None, sub_sub=None, sub_sub_sub=None, group=None):
+        rows.append((indicator, question_type, question_text, sub, sub_sub, sub_sub_sub, group))
+
+    # OO 1, the day, month and year answers are filled per signatory
+    for part in utils.DATE_PARTS:
+        add('OO 1', utils.SINGLE_CHOICE_TYPE_PRI, 'What is the year-end date of the 12-month period you have chosen to report for PRI reporting purposes?',\
+            '(A) Year-end date', part)
+
+    # OO 2 and OO 2.1, one option selected per signatory
+    add('OO 2', utils.SINGLE_CHOICE_TYPE_PRI, 'Does your organisation have any subsidiaries?', '(A) Yes', group='OO 2')
+    add('OO 2', utils.SINGLE_CHOICE_TYPE_PRI, 'Does your organisation have any subsidiaries?', '(B) No', group='OO 2')
+    add('OO 2.1', utils.SINGLE_CHOICE_TYPE_PRI, 'Are any of your subsidiaries PRI signatories in their own right?', '(A) Yes', group='OO 2.1')
+    add('OO 2.1', utils.SINGLE_CHOICE_TYPE_PRI, 'Are any of your subsidiaries PRI signatories in their own right?', '(B) No', group='OO 2.1')
+    for n in range(4):
+        add('OO 2.2', utils.SINGLE_CHOICE_TYPE_PRI, overview.OO2_2_n_question, str(n), group='OO 2.2 n')
+    add('OO 2.2', utils.TEXT_TYPE_PRI, overview.OO2_2_list_question)
+    add('OO 2.2', utils.SINGLE_CHOICE_TYPE_PRI, overview.OO2_2_list_question, sub_sub='(1) Yes, the responsible investment activities of this subsidiary will be included in this report', group='OO 2.2 included')
+    add('OO 2.2', utils.SINGLE_CHOICE_TYPE_PRI, overview.OO2_2_list_question, sub_sub='(2) No, the responsible investment activities of this subsidiary will be included in their separate report', group='OO 2.2 included')
+    add('OO 3', utils.TEXT_TYPE_PRI, 'What is the end date of your fundraising?')
+
+    # OO 4 to OO 7 follow the column spec of add_aum_data, its missing filters are filled with defaults
+    specs = overview.AUM_COLUMNS.astype(object).where(overview.AUM_COLUMNS.notna(), None)
+    for spec in specs.to_dict('records'):
+        if spec['value'] == 'sub_sub_sub_question_text':
+            for band in PCT_BANDS:
+                add(spec['indicator'], utils.SINGLE_CHOICE_TYPE_PRI, 'Provide a breakdown of your AUM in emerging markets.',\
+                    spec['sub_question_text'], '(1) Emerging markets', band, group=spec['column'])
+        else:
+            add(spec['indicator'], spec['question_type_pri'] or utils.PERCENTAGE_TYPE_PRI, spec['question_text'] or 'Provide a breakdown of your AUM.',\
+                spec['sub_question_text'], spec['sub_sub_question_text'])
+
+    # Remaining indicators, multi choice options with a few single choice and text questions
+    for i in range(n_indicators):
+        indicator = f'OO {8 + i}'
+        if indicator in CLEANUP_OPTIONS:
+            for option in CLEANUP_OPTIONS[indicator]:
+                add(indicator, utils.MULTI_TYPE_PRI, f'Question {indicator}', option, '(1) Yes')
+        elif i % 4 == 3:
+            for j in range(n_options):
+                add(indicator, utils.SINGLE_CHOICE_TYPE_PRI, f'Question {indicator}', f'({chr(65 + j % 26)}) Option {j + 1}', group=indicator)
+        elif i % 4 == 2:
+            add(indicator, utils.TEXT_TYPE_PRI, f'Question {indicator}', f'(A) Describe {indicator}')
+        else:
+            for j in range(n_options):
+                add(indicator, utils.MULTI_TYPE_PRI, f'Question {indicator}', f'({chr(65 + j % 26)}) Option {j + 1}')
+
+    return pd.DataFrame(rows, columns=['indicator', 'question_type_pri', 'question_text', 'sub_question_text',\
+                                       'sub_sub_question_text', 'sub_sub_sub_question_text', 'group'])
+
+def generate_export(n_signatories=1000, n_indicators=20, n_options=5, seed=0):
+    """
+    Generate a synthetic PRI Organisational Overview export.
+
+    Every signatory answers every question of a form made of the OO 1 date, the OO 2 to OO 7
+    questions of the signatory profile specs and n_indicators further indicators of
+    n_options options each.
+
+    Parameters:
+    n_signatories (int): The number of signatories. Default is 1000.
+    n_indicators (int): The number of indicators after OO 7. Default is 20.
+    n_options (int): The number of options of the choice questions. Default is 5.
+    seed (int): The seed of the random generator. Default is 0.
+
+    Returns:
+    pd.DataFrame: The export, with the EXPORT_COLUMNS layout.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    regions = rng.choice(list(COUNTRIES), n_signatories)
+    df_signatories = pd.DataFrame({'Signatory Name': [f'Signatory {i:06d}' for i in range(n_signatories)],
+                                   'signatory_category': rng.choice(SIGNATORY_CATEGORIES, n_signatories),
+                                   'aum_band': rng.choice(AUM_BANDS, n_signatories),
+                                   'Peering Country': [rng.choice(COUNTRIES[region]) for region in regions],
+                                   'region': regions,
+                                   'sigtype': rng.choice(['SIG', 'SUP'], n_signatories)})
+
+    df_form = _form(n_indicators, n_options)
+    df = df_signatories.merge(df_form, how='cross')
+    n = len(df)
+
+    # Single choice groups select exactly one option, the other questions are selected at random
+    selected = rng.random(n) < 0.6
+    grouped = df['group'].notna().to_numpy()
+    groups = df.loc[grouped, ['Signatory Name', 'group']].groupby(['Signatory Name', 'group'], sort=False)
+    group_id = groups.ngroup().to_numpy()
+    choice = (rng.random(groups.ngroups) * groups.size().to_numpy()).astype(int)
+    selected[grouped] = groups.cumcount().to_numpy() == choice[group_id]
+
+    date = (df['indicator'] == 'OO 1').to_numpy()
+    selected[date] = True
+    parts = df.loc[date, 'sub_sub_question_text'].to_numpy()
+    df.loc[date, 'sub_sub_sub_question_text'] = np.where(parts == 'Date', rng.integers(1, 29, date.sum()).astype(str),\
+                                                np.where(parts == 'Month', rng.integers(1, 13, date.sum()).astype(str), '2022'))
+
+    question_type = df['question_type_pri'].to_numpy()
+    response = np.full(n, np.nan, dtype=object)
+    money = question_type == utils.MONEY_TYPE_PRI
+    # Amounts in US dollars, in another currency or without one, converted with the OO 4 FX rate
+    currencies = rng.choice(['US$ ', 'EUR ', ''], money.sum())
+    response[money] = [f'{currency}{value:,}.00' for currency, value in zip(currencies, rng.integers(1, 10**9, money.sum()))]
+    percentage = question_type == utils.PERCENTAGE_TYPE_PRI
+    response[percentage] = [f'{value}%' for value in rng.integers(0, 101, percentage.sum())]
+    text = question_type == utils.TEXT_TYPE_PRI
+    response[text] = rng.choice(['N/A', 'See our annual report.', '31/12/2022', '1.0834'], text.sum())
+
+    df['response_answer'] = np.where(selected, 'Selected', 'Not Selected')
+    df[' Signatory_Public_Response '] = np.where(selected, response, np.nan)
+    df['module_short'] = 'OO'
+    df['section'] = 'Organisational Overview'
+    df['subsection'] = 'Organisational information'
+    df['Core/Plus'] = 'Core'
+    df['response_group_text'] = np.nan
+    df['Column2'] = np.nan
+    df['UID'] = np.arange(1, n + 1)
+
+    return df[EXPORT_COLUMNS]
+
+def write_export(filename, n_signatories=1000, n_indicators=20, n_options=5, seed=0, encoding='ISO-8859-1'):
+    """
+    Generate a synthetic export and write it to a CSV file like the PRI one.
+
+    The OO 7 options keep the '\x96' en dashes of the specs, written as the Windows-1252 byte of the PRI export.
+    Other characters the encoding cannot represent are replaced.
+
+    Parameters:
+    filename (str): The path of the CSV file.
+    n_signatories (int): The number of signatories. Default is 1000.
+    n_indicators (int): The number of indicators after OO 7. Default is 20.
+    n_options (int): The number of options of the choice questions. Default is 5.
+    seed (int): The seed of the random generator. Default is 0.
+    encoding (str): The encoding of the CSV file. Default is 'ISO-8859-1'.
+
+    Returns:
+    int: The number of rows written.
+    """
+
+    df = generate_export(n_signatories, n_indicators, n_options, seed)
+    df.to_csv(filename, index=False, encoding=encoding, errors='replace')
+
+    return len(df)
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Write a synthetic PRI OO export.')
+    parser.add_argument('filename', help='path of the CSV file')
+    parser.add_argument('--signatories', type=int, default=1000)
+    parser.add_argument('--indicators', type=int, default=20)
+    parser.add_argument('--options', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = write_export(args.filename, args.signatories, args.indicators, args.options, args.seed)
+    logging.info(f'Wrote {rows} rows to {args.filename}')
+
+    sys.exit(0)
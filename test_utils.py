@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import overview
+import utils
+
+
+@pytest.mark.parametrize('text, value, currency', [
+    ('US$ 1,250,000.00', 1250000.0, 'USD'),
+    ('12.5 bn USD', 12.5e9, 'USD'),
+    ('EUR 3 m', 3e6, 'EUR'),
+    ('1,000', 1000.0, None),
+    ('1.5 million', 1.5e6, None),
+    ('< 5%', None, None),
+    ('45%', None, None),
+])
+def test_parse_numeric_money(text, value, currency):
+
+    values, currencies = utils.parse_numeric(pd.Series([text]), utils.MONEY_TYPE_PRI)
+
+    assert values[0] == value if value is not None else np.isnan(values[0])
+    assert currencies[0] == currency if currency is not None else pd.isna(currencies[0])
+
+@pytest.mark.parametrize('text, value', [
+    ('45%', 45.0),
+    ('100', 100.0),
+    ('< 5%', 2.5),
+    ('>75%', 87.5),
+    ('>10-50%', 30.0),
+    ('1,250,000', None),
+    ('1.5 million', None),
+    ('150%', None),
+    ('-5%', None),
+    ('US$ 5', None),
+])
+def test_parse_numeric_percentage(text, value):
+
+    values = utils.parse_numeric(pd.Series([text]), utils.PERCENTAGE_TYPE_PRI)[0]
+
+    assert values[0] == value if value is not None else np.isnan(values[0])
+
+def test_parse_range_bands():
+
+    low, high, _ = utils.parse_range(pd.Series(['>75%', '< 5%', '>10-50%', '45%', None]), utils.PERCENTAGE_TYPE_PRI)
+
+    assert low.tolist()[:4] == [75.0, 0.0, 10.0, 45.0]
+    assert high.tolist()[:4] == [100.0, 5.0, 50.0, 45.0]
+    assert np.isnan(low[4]) and np.isnan(high[4])
+
+def test_convert_aum_data_fx_rate():
+
+    df = pd.DataFrame({'report_ID': [1, 2, 3, 4],
+                       'OO4_AUM_org': ['US$ 1,000.00', 'EUR 1,000.00', '1,000.00', '1,000.00'],
+                       'OO4_AUM_FX_Rate': ['1.1', '1.1', '1.1', None]})
+
+    df, problems = overview.convert_aum_data(df)
+
+    # Amounts without a currency are converted with the rate, or taken as US dollars without one
+    assert df['OO4_AUM_org_USD'].tolist() == pytest.approx([1000.0, 1100.0, 1100.0, 1000.0])
+    assert df['OO4_AUM_org'].tolist() == ['US$ 1,000.00', 'EUR 1,000.00', '1,000.00', '1,000.00']
+    assert problems.empty
+
+def test_convert_aum_data_keeps_answers():
+
+    df = pd.DataFrame({'report_ID': [1, 2],
+                       'OO4_AUM_FX_Rate': ['See our annual report.', '1.1'],
+                       'OO7_AUM_PCT_Listed_Equity_Emerging_mkt': ['>75%', '>10-50%']})
+
+    df, problems = overview.convert_aum_data(df)
+
+    assert df['OO4_AUM_FX_Rate'].tolist() == ['See our annual report.', '1.1']
+    assert df['OO7_AUM_PCT_Listed_Equity_Emerging_mkt'].tolist() == ['>75%', '>10-50%']
+    assert df['OO7_AUM_PCT_Listed_Equity_Emerging_mkt_low'].tolist() == [75.0, 10.0]
+    assert df['OO7_AUM_PCT_Listed_Equity_Emerging_mkt_high'].tolist() == [100.0, 50.0]
+    assert problems[['report_ID', 'column', 'rule']].values.tolist() == [[1, 'OO4_AUM_FX_Rate', 'aum_unparseable']]
@@ -1,33 +1,375 @@
 from tqdm import tqdm
-import sys, logging
+import os, sys, glob, hashlib, logging
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
 
 groupedby= 'Signatory Name'
 
-def load_csv(filename, chunk_size=10000, encoding='utf-8'):
+# Columns identifying a signatory across the export
+SIGNATORY_KEYS = [groupedby, 'signatory_category', 'aum_band', 'Peering Country', 'region', 'sigtype']
+
+# Low-cardinality columns of the PRI export, stored as categoricals on load. The question texts repeat
+# for every signatory, so the table carries each of them once however many rows answer it
+CATEGORICAL_COLUMNS = ['module_short', 'section', 'subsection', 'indicator', 'Core/Plus', 'question_type_pri', 'response_answer',\
+                       'question_text', 'sub_question_text', 'sub_sub_question_text', 'sub_sub_sub_question_text',\
+                       'signatory_category', 'aum_band', 'Peering Country', 'region', 'sigtype']
+
+CSV_SCHEMA = {col: 'category' for col in CATEGORICAL_COLUMNS}
+
+# Bump whenever load_csv or CSV_SCHEMA change the parsed output, it invalidates every cached copy
+LOADER_SCHEMA_VERSION = 3
+
+def csv_dtypes(filename, encoding='utf-8', schema=CSV_SCHEMA, default_dtype=str):
+    """
+    Build the dtype of every column of a CSV file from its header.
+
+    Columns outside the schema are read as text, so their dtype never depends on the values of
+    a chunk and every chunk of a file is typed identically.
+    
+    Parameters:
+    filename (str): The path to the CSV file.
+    encoding (str): The encoding of the CSV file. Default is 'utf-8'.
+    schema (dict): Column name to dtype mapping. Default is CSV_SCHEMA.
+    default_dtype: The dtype of the columns not in the schema. Default is str.
+
+    Returns:
+    dict: Column name to dtype mapping covering every column of the file.
+    """
+
+    columns = pd.read_csv(filename, nrows=0, encoding=encoding).columns
+
+    return {col: schema.get(col, default_dtype) for col in columns}
+
+def iter_csv(filename, chunk_size=10000, encoding='utf-8', schema=CSV_SCHEMA, engine=None):
     """
-    Load a large CSV file in chunks and concatenate the chunks into a single DataFrame.
+    Read a large CSV file in typed chunks, reporting progress by bytes read.
     
     Parameters:
     filename (str): The path to the CSV file.
     chunk_size (int): The number of rows per chunk. Default is 10000.
     encoding (str): The encoding of the CSV file. Default is 'utf-8'.
+    schema (dict): Column name to dtype mapping applied while parsing. Default is CSV_SCHEMA.
+    engine (str): Parser engine passed to pd.read_csv. Default is None.
+
+    Yields:
+    pd.DataFrame: The next chunk of the file.
+    """
+
+    dtype = csv_dtypes(filename, encoding, schema)
+
+    with tqdm(total=os.path.getsize(filename), unit='B', unit_scale=True) as pbar, open(filename, 'rb') as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_size, encoding=encoding, dtype=dtype, engine=engine):
+            pbar.update(f.tell() - pbar.n)
+            yield chunk
+
+def load_csv(filename, chunk_size=10000, encoding='utf-8', schema=CSV_SCHEMA, engine=None):
+    """
+    Load a large CSV file in a single pass and join the chunks once into a typed DataFrame.
+    
+    Parameters:
+    filename (str): The path to the CSV file.
+    chunk_size (int): The number of rows per chunk. Default is 10000.
+    encoding (str): The encoding of the CSV file. Default is 'utf-8'.
+    schema (dict): Column name to dtype mapping applied while parsing. Default is CSV_SCHEMA.
+    engine (str): Parser engine passed to pd.read_csv. 'pyarrow' parses the whole file at once. Default is None.
 
     Returns:
-    pd.DataFrame: The concatenated DataFrame containing all the data from the CSV file.
+    pd.DataFrame: The DataFrame containing all the data from the CSV file.
+    """
+
+    if engine == 'pyarrow':
+        with tqdm(total=os.path.getsize(filename), unit='B', unit_scale=True) as pbar:
+            df = pd.read_csv(filename, encoding=encoding, dtype=csv_dtypes(filename, encoding, schema), engine=engine)
+            pbar.update(pbar.total)
+        return df
+
+    chunks = list(iter_csv(filename, chunk_size, encoding, schema, engine))
+
+    if not chunks:
+        return pd.DataFrame()
+
+    return concat_categorical(chunks)
+
+def concat_categorical(frames):
     """
+    Concatenate DataFrames whose categorical columns have different categories, keeping the categorical dtype.
     
-    df = pd.DataFrame()
+    Parameters:
+    frames (list): The DataFrames, with the same columns. Their categorical columns are modified in place.
+
+    Returns:
+    pd.DataFrame: The concatenated DataFrame with a new RangeIndex.
+    """
+
+    # Categories differ between frames, align them so the concat keeps the categorical dtype
+    for col in frames[0].select_dtypes('category').columns:
+        if not all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        dtype = pd.CategoricalDtype(union_categoricals([frame[col] for frame in frames]).categories)
+        for frame in frames:
+            frame[col] = frame[col].astype(dtype)
 
-    total_rows = sum(1 for _ in open(filename, encoding=encoding))
+    return pd.concat(frames, ignore_index=True)
 
-    with tqdm(total=total_rows) as pbar:
-        for chunk in pd.read_csv(filename, chunksize=chunk_size, encoding=encoding):
-            df = pd.concat([df, chunk], ignore_index=True)
-            pbar.update(chunk.shape[0])
+def file_fingerprint(filename, schema=CSV_SCHEMA, encoding='utf-8', engine=None, block_size=1 << 20):
+    """
+    Compute the cache key of a source file from its size, mtime, content hash and the loader settings.
+    
+    Parameters:
+    filename (str): The path to the CSV file.
+    schema (dict): The schema the file is parsed with. Default is CSV_SCHEMA.
+    encoding (str): The encoding the file is decoded with. Default is 'utf-8'.
+    engine (str): The parser engine. Default is None.
+    block_size (int): The number of bytes hashed at a time. Default is 1 MiB.
+
+    Returns:
+    str: A hexadecimal key identifying this version of the file and of the loader.
+    """
+
+    stat = os.stat(filename)
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{stat.st_size}|{stat.st_mtime_ns}|{LOADER_SCHEMA_VERSION}|{sorted(schema.items())}|{encoding}|{engine}'.encode())
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+def load_csv_cached(filename, cache_dir=None, encoding='utf-8', schema=CSV_SCHEMA, engine=None):
+    """
+    Load a CSV file through an on-disk Feather cache of the parsed and typed DataFrame.
+
+    The cache lives next to the source file unless cache_dir is given. A rerun on an unchanged
+    file memory-maps the cached copy instead of parsing, stale copies of the same file are removed.
+    When the cache cannot be written, e.g. next to a source in a read-only directory, the parsed
+    DataFrame is returned with a warning.
+    
+    Parameters:
+    filename (str): The path to the CSV file.
+    cache_dir (str): The directory holding the cached copies. Default is the directory of filename.
+    encoding (str): The encoding of the CSV file. Default is 'utf-8'.
+    schema (dict): Column name to dtype mapping applied while parsing. Default is CSV_SCHEMA.
+    engine (str): Parser engine passed to load_csv. Default is None.
+
+    Returns:
+    pd.DataFrame: The DataFrame containing all the data from the CSV file.
+    """
+
+    if feather is None:
+        logging.warning('pyarrow is not installed, loading ' + filename + ' without cache')
+        return load_csv(filename, encoding=encoding, schema=schema, engine=engine)
+
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(filename))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        # A directory that cannot be created is reported when the cache is written
+        pass
+
+    prefix = os.path.join(cache_dir, '.' + os.path.basename(filename) + '.')
+    cache_file = prefix + file_fingerprint(filename, schema, encoding, engine) + '.feather'
+
+    for stale_file in glob.glob(glob.escape(prefix) + '*.feather'):
+        if stale_file != cache_file:
+            logging.info('Removing stale cache ' + stale_file)
+            try:
+                os.remove(stale_file)
+            except OSError as error:
+                logging.warning(f'Could not remove stale cache {stale_file}: {error}')
+
+    if os.path.exists(cache_file):
+        logging.info('Loading cached copy ' + cache_file)
+        return feather.read_table(cache_file, memory_map=True).to_pandas()
+
+    df = load_csv(filename, encoding=encoding, schema=schema, engine=engine)
+
+    # Write under a temporary name so an interrupted run never leaves a truncated cache behind
+    tmp_file = cache_file + '.tmp'
+    try:
+        feather.write_feather(df, tmp_file)
+        os.replace(tmp_file, cache_file)
+    except OSError as error:
+        logging.warning(f'Could not cache {filename} in {cache_dir}, continuing without cache: {error}')
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
     return df
 
+INDEX_KEYS = ['indicator', 'question_type_pri', 'response_answer']
+
+class ResponseIndex:
+    """
+    Indexed view of the response table, grouped once by (indicator, question_type_pri, response_answer).
+
+    Lookups return the row positions or the sub-frame of a key without scanning the table again.
+    None acts as a wildcard for question_type and response_answer. The index is only valid for
+    the DataFrame it was built from, build a new one after filtering or merging.
+    
+    Parameters:
+    df (pd.DataFrame): The response table to index.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._groups = {}
+        self._keys_by_indicator = {}
+
+        for key, positions in df.groupby(INDEX_KEYS, observed=True, sort=False, dropna=False).indices.items():
+            self._groups[key] = positions
+            self._keys_by_indicator.setdefault(key[0], []).append(key)
+
+    def indicators(self):
+        return list(self._keys_by_indicator)
+
+    def positions(self, indicator, question_type=None, response_answer=None):
+        """
+        Return the sorted row positions of an (indicator, question_type, response_answer) key.
+        
+        Parameters:
+        indicator (str): The indicator, e.g. 'OO 4'.
+        question_type (str): The question_type_pri value, or None for all types.
+        response_answer (str): The response_answer value, or None for all answers.
+
+        Returns:
+        np.ndarray: The row positions in the indexed DataFrame.
+        """
+
+        key = (indicator, question_type, response_answer)
+        if key not in self._groups:
+            # Partial keys are assembled from the full keys once and memoized
+            matches = [self._groups[k] for k in self._keys_by_indicator.get(indicator, [])\
+                       if (question_type is None or k[1] == question_type) and (response_answer is None or k[2] == response_answer)]
+            self._groups[key] = np.sort(np.concatenate(matches)) if matches else np.array([], dtype=np.intp)
+
+        return self._groups[key]
+
+    def frame(self, indicator, question_type=None, response_answer=None):
+        """
+        Return the rows of an (indicator, question_type, response_answer) key as a DataFrame.
+        
+        Parameters:
+        indicator (str): The indicator, e.g. 'OO 4'.
+        question_type (str): The question_type_pri value, or None for all types.
+        response_answer (str): The response_answer value, or None for all answers.
+
+        Returns:
+        pd.DataFrame: The matching rows of the indexed DataFrame.
+        """
+
+        return self.df.iloc[self.positions(indicator, question_type, response_answer)]
+
+    def exclude(self, indicators):
+        """
+        Return the indexed DataFrame without the rows of the given indicators.
+        
+        Parameters:
+        indicators (list): The indicators to drop.
+
+        Returns:
+        pd.DataFrame: The remaining rows, in their original order.
+        """
+
+        kept = [self._groups[key] for indicator, keys in self._keys_by_indicator.items() if indicator not in indicators for key in keys]
+
+        return self.df.iloc[np.sort(np.concatenate(kept)) if kept else []]
+
+CLEANUP_RULE_FIELDS = ['indicator', 'match_column', 'match_value', 'target_column', 'pattern', 'replacement']
+
+def load_cleanup_rules(filename):
+    """
+    Load a cleanup rule table from a CSV file.
+
+    Each rule applies to the rows of one indicator, optionally restricted to the rows where
+    match_column equals match_value. Without a pattern the target column is set to the
+    replacement, otherwise the pattern is replaced by the replacement in the target column.
+    
+    Parameters:
+    filename (str): The path to the CSV file, with the CLEANUP_RULE_FIELDS columns.
+
+    Returns:
+    pd.DataFrame: The rule table, in file order.
+    """
+
+    rules = pd.read_csv(filename, dtype=str)
+
+    missing_columns = [col for col in CLEANUP_RULE_FIELDS if col not in rules.columns]
+    if missing_columns:
+        logging.error(f"Columns {missing_columns} are missing from the cleanup rules in {filename}")
+
+    return rules
+
+def _assign_rows(df, rows, col, values):
+
+    # Categoricals only accept known values, register the new ones first
+    if isinstance(df[col].dtype, pd.CategoricalDtype):
+        new_categories = pd.Index(pd.unique(np.atleast_1d(values))).difference(df[col].cat.categories).dropna()
+        if len(new_categories):
+            df[col] = df[col].cat.add_categories(new_categories)
+
+    df.iloc[rows, df.columns.get_loc(col)] = values
+
+def apply_cleanup_rules(df, rules, index=None):
+    """
+    Apply a cleanup rule table to the response table in place.
+
+    Rules are grouped by indicator and only read and write that indicator's rows. Every match of
+    an indicator is evaluated before its rules are applied, so a rule rewriting the matched
+    column does not hide the rows from the following rules. Replacements run on the distinct
+    values of the partition and are mapped back to the rows.
+    
+    Parameters:
+    df (pd.DataFrame): The response table.
+    rules (pd.DataFrame): The rule table, see load_cleanup_rules.
+    index (ResponseIndex): An index built on df. Default is None, which builds one.
+
+    Returns:
+    pd.DataFrame: The cleaned DataFrame.
+    pd.DataFrame: The rule table with the number of rows each rule changed in 'rows_touched'.
+    """
+
+    if index is None:
+        index = ResponseIndex(df)
+
+    rows_touched = pd.Series(0, index=rules.index)
+
+    for indicator, indicator_rules in rules.groupby('indicator', sort=False):
+
+        logging.info('Cleaning ' + indicator)
+        positions = index.positions(indicator)
+
+        matches = {}
+        for i, rule in indicator_rules.iterrows():
+            if pd.isna(rule['match_column']):
+                matches[i] = positions
+            else:
+                matches[i] = positions[df[rule['match_column']].iloc[positions].to_numpy() == rule['match_value']]
+
+        for i, rule in indicator_rules.iterrows():
+            rows = matches[i]
+
+            if pd.isna(rule['pattern']):
+                _assign_rows(df, rows, rule['target_column'], rule['replacement'])
+                rows_touched[i] = len(rows)
+                continue
+
+            values = df[rule['target_column']].iloc[rows].to_numpy(dtype=object)
+            codes, uniques = pd.factorize(values)
+            replaced = pd.Series(uniques, dtype=object).str.replace(rule['pattern'], rule['replacement'], regex=False).to_numpy()
+
+            changed = (codes >= 0) & (replaced != uniques)[codes]
+            _assign_rows(df, rows[changed], rule['target_column'], replaced[codes[changed]])
+            rows_touched[i] = changed.sum()
+
+    return df, rules.assign(rows_touched=rows_touched)
+
 def remove_columns(df, columns_to_remove):
     """
     Remove specified columns from the DataFrame.
@@ -62,51 +404,138 @@ def merge_and_rename_column(df, df_right, col_name, new_name):
 
     return df
 
+# Fields of a column-spec table, None in a filter field matches any value
+SPEC_FIELDS = ['column', 'indicator', 'question_type_pri', 'question_text', 'sub_question_text', 'sub_sub_question_text', 'value']
+
+def build_column_spec(rows):
+    """
+    Build a column-spec table from (column, indicator, question_type_pri, question_text,
+    sub_question_text, sub_sub_question_text, value) tuples.
+    
+    Parameters:
+    rows (list): One tuple per output column, following SPEC_FIELDS.
+
+    Returns:
+    pd.DataFrame: The column-spec table.
+    """
+
+    spec = pd.DataFrame(rows, columns=SPEC_FIELDS)
+
+    if spec['column'].duplicated().any():
+        logging.error(f"Duplicate output columns in column spec: {spec.loc[spec['column'].duplicated(), 'column'].tolist()}")
+
+    return spec
+
+def pivot_columns(df, df_right, spec):
+    """
+    Add one column per spec row to df, taking the value of the matching rows of df_right.
+
+    The matching rows of all spec rows are collected in long format, pivoted once to one row
+    per 'report_ID' and joined once onto df. When several rows of df_right match the same
+    (report_ID, column) the first one is kept and the collisions are reported per column.
+    
+    Parameters:
+    df (pd.DataFrame): The DataFrame to extend, with a 'report_ID' column.
+    df_right (pd.DataFrame): The responses to take the values from, with a 'report_ID' column.
+    spec (pd.DataFrame): The column-spec table, see build_column_spec.
+
+    Returns:
+    pd.DataFrame: df with the spec columns added, in spec order.
+    """
+
+    filter_fields = SPEC_FIELDS[1:-1]
+
+    # Spec rows filtering on the same fields and reading the same value column are matched in one merge
+    groups = {}
+    for row in spec.to_dict('records'):
+        used = tuple(field for field in filter_fields if pd.notna(row[field]))
+        groups.setdefault((used, row['value']), []).append(row)
+
+    pieces = []
+    for (used, value), rows in groups.items():
+        keys = pd.DataFrame([[row[field] for field in used] + [row['column']] for row in rows], columns=list(used) + ['column'])
+        right = df_right[['report_ID', value] + list(used)].astype({field: object for field in used})
+        matched = right.merge(keys, on=list(used), how='inner')
+        pieces.append(matched[['report_ID', 'column', value]].rename(columns={value: 'value'}))
+
+    long = pd.concat(pieces, ignore_index=True).dropna(subset=['report_ID'])
+
+    duplicated = long.duplicated(['report_ID', 'column'])
+    if duplicated.any():
+        collisions = long[duplicated].groupby('column').size()
+        logging.error(f"Several responses for the same report_ID, keeping the first one:\n{collisions.to_string()}")
+        long = long[~duplicated]
+
+    wide = long.pivot(index='report_ID', columns='column', values='value').reindex(columns=spec['column'])
+    wide.columns.name = None
+
+    return df.join(wide, on='report_ID')
+
+DATE_PARTS = ['Date', 'Month', 'Year']
+
 def extract_date(df):
     """
-    Filter the DataFrame df_oo1 by column 'response_answer' equal to 'Selected'.
+    Assemble the 'OO 1' reporting year end date of every signatory in one vectorized pass.
+
+    The Date, Month and Year answers are pivoted to one row per signatory and combined into
+    a datetime64 date. Months can be numbers, month names or abbreviated month names such as 'Dec'.
     
     Parameters:
-    df_oo1 (pd.DataFrame): DataFrame containing data where 'indicator' column equals 'OO 1'.
+    df (pd.DataFrame): DataFrame containing data where 'indicator' column equals 'OO 1'.
 
     Returns:
-    pd.DataFrame: Filtered DataFrame containing only rows where 'response_answer' column is 'Selected'.
+    pd.DataFrame: One 'Selected' row per signatory with the date in 'sub_sub_sub_question_text'.
+    pd.DataFrame: The raw Date, Month and Year of the signatories whose date is missing or invalid.
     """
 
 
     logging.info('Extracting date from \'OO 1\' questions')
     df = df[df['response_answer'] == 'Selected']
-        
-    # Group by 'Signature Name' to process each group individually
 
-    grouped = df.groupby(groupedby)
+    signatories = df.drop_duplicates(subset=SIGNATORY_KEYS).copy()
 
-    df = df[df['sub_sub_question_text'] == 'Date']
-    
-    for name, group in grouped:
-        day = group[group['sub_sub_question_text'] == 'Date']['sub_sub_sub_question_text'].values
-        month = group[group['sub_sub_question_text'] == 'Month']['sub_sub_sub_question_text'].values
-        year = group[group['sub_sub_question_text'] == 'Year']['sub_sub_sub_question_text'].values
-        
-        if day.size > 0 and month.size > 0 and year.size > 0:
-            date_str = f"{day[0]}/{month[0]}/{year[0]}"
-            df.loc[df[groupedby] == name, 'sub_sub_sub_question_text'] = date_str
-        else:
-            logging.error('Incorrect date format for Signatory Name ' + name )
+    if signatories.empty:
+        signatories['sub_sub_sub_question_text'] = pd.Series(dtype='datetime64[ns]')
+        return signatories, pd.DataFrame(columns=[groupedby] + DATE_PARTS)
 
-    return df
+    # Keep the first answer of each part, as a signatory may have answered a part several times
+    parts = df[df['sub_sub_question_text'].isin(DATE_PARTS)].drop_duplicates(subset=[groupedby, 'sub_sub_question_text'])
+    parts = parts.pivot(index=groupedby, columns='sub_sub_question_text', values='sub_sub_sub_question_text')
+    # The answers are categoricals, which pd.to_datetime does not always parse to datetimes
+    parts = parts.reindex(index=signatories[groupedby].unique(), columns=DATE_PARTS).astype(str)
+    parts.columns.name = None
+
+    month = pd.to_numeric(parts['Month'], errors='coerce')
+    for month_format in ['%B', '%b']:
+        month = month.fillna(pd.to_datetime(parts['Month'], format=month_format, errors='coerce').dt.month)
+
+    dates = pd.to_datetime(pd.DataFrame({'year': pd.to_numeric(parts['Year'], errors='coerce'),
+                                         'month': month,
+                                         'day': pd.to_numeric(parts['Date'], errors='coerce')}), errors='coerce')
+
+    signatories['sub_sub_sub_question_text'] = signatories[groupedby].map(dates)
+
+    invalid_dates = parts[dates.isna()].reset_index(names=groupedby)
+
+    return signatories, invalid_dates
 
 def build_signatory_profile(df):
 
-    df=extract_date(df)
+    df, invalid_dates = extract_date(df)
+
+    if not invalid_dates.empty:
+        logging.error(f"Incorrect date format for {len(invalid_dates)} signatories:\n{invalid_dates.to_string(index=False)}")
 
     df = remove_columns(df, ['indicator', 'question_text', 'sub_question_text', 'sub_sub_question_text', 'response_group_text', 'module_short'])
     df = remove_columns(df, ['section', 'subsection', 'question_type_pri', 'response_answer', ' Signatory_Public_Response ', 'Column2', 'UID'])
 
+    if 'question_id' in df.columns:
+        df = remove_columns(df, ['question_id'])
+
     df = df.rename(columns={'sub_sub_sub_question_text': 'OO1_year_end_date'})
 
     # Check for duplicate combinations
-    duplicates = df.duplicated(subset=[groupedby, 'signatory_category', 'aum_band', 'Peering Country', 'region', 'sigtype'], keep=False)
+    duplicates = df.duplicated(subset=SIGNATORY_KEYS, keep=False)
     
     if duplicates.any():
         duplicate_rows = df[duplicates]
@@ -114,64 +543,392 @@ def build_signatory_profile(df):
     else:
         logging.info("All Signatories are unique.")
 
-    df['report_ID'] = range(1, 1+ len(df))
+    df['report_ID'] = signatory_key(df)
+
+    collisions = df['report_ID'].duplicated(keep=False) & ~duplicates
+    if collisions.any():
+        logging.error(f"Signatories sharing a report_ID:\n{df[collisions]}")
 
     return df
 
+def signatory_key(df):
+    """
+    Compute a 64-bit hash of the SIGNATORY_KEYS of every row.
+
+    Categorical columns are hashed through their categories and codes, so the cost grows with
+    the number of distinct values rather than rows. The key only depends on the values, so the
+    same signatory gets the same key across runs, chunks and exports.
+    
+    Parameters:
+    df (pd.DataFrame): A table with the SIGNATORY_KEYS columns.
+
+    Returns:
+    pd.Series: The int64 keys, with the index of df.
+    """
+
+    keys = pd.util.hash_pandas_object(df[SIGNATORY_KEYS], index=False).to_numpy().view(np.int64)
+
+    return pd.Series(keys, index=df.index, name='report_ID')
+
+# Columns numbering the rows of an export, they change when rows are added or removed before them
+EXPORT_ID_COLUMNS = ['UID', 'Column2']
+
+def signatory_content_hash(df):
+    """
+    Compute a hash of the rows of every signatory, to tell which signatories changed between two exports.
+
+    The rows are hashed one by one with their position among the rows of their signatory and summed
+    per signatory_key, so the hash depends on the order of the rows of a signatory but not on how the
+    signatories are interleaved. The EXPORT_ID_COLUMNS are not hashed.
+    
+    Parameters:
+    df (pd.DataFrame): The export as loaded.
+
+    Returns:
+    pd.Series: The uint64 content hash, indexed by report_ID.
+    """
+
+    keys = signatory_key(df).to_numpy()
+    content = df.drop(columns=EXPORT_ID_COLUMNS, errors='ignore').assign(position=pd.Series(keys).groupby(keys).cumcount().to_numpy())
+    rows = pd.util.hash_pandas_object(content, index=False).to_numpy()
+
+    return pd.Series(rows, name='content_hash').groupby(keys).sum().rename_axis('report_ID')
+
 def set_report_id(df, df_signatory):
+    """
+    Set the 'report_ID' column of the response table to the ID of its signatory.
+
+    The report_ID of build_signatory_profile is the signatory_key, so the IDs are computed from the
+    responses and only looked up in the signatory table instead of merging on the string keys.
+    
+    Parameters:
+    df (pd.DataFrame): The response table.
+    df_signatory (pd.DataFrame): The signatory profile.
+
+    Returns:
+    pd.DataFrame: The response table with a new RangeIndex and the 'report_ID' column.
+    """
 
-    match_cols = [groupedby, 'signatory_category', 'aum_band', 'Peering Country', 'region', 'sigtype']
+    keys = signatory_key(df)
+    known = keys.isin(df_signatory['report_ID']).to_numpy()
 
-    df = pd.merge(df, df_signatory[match_cols + ['report_ID']], on=match_cols, how='left', validate=None)
+    df = df.reset_index(drop=True)
+
+    # Responses without a matching signatory keep a missing ID rather than turning every ID into a float
+    df['report_ID'] = pd.arrays.IntegerArray(keys.to_numpy(), ~known)
+
+    return df
+
+# Columns identifying a question of the survey form
+FORM_COLUMNS = ['module_short', 'question_type_pri', 'indicator', 'Core/Plus',\
+                'question_text', 'sub_question_text', 'sub_sub_question_text','sub_sub_sub_question_text']
+
+def set_question_id(df):
+    """
+    Set the 'question_id' column to a 64-bit hash of the FORM_COLUMNS of every row.
+
+    The ID only depends on the question texts, so it is stable across runs, chunks and exports.
+    Rerun it after changing any of the question texts.
+    
+    Parameters:
+    df (pd.DataFrame): The response table.
+
+    Returns:
+    pd.DataFrame: The DataFrame with the 'question_id' column.
+    """
+
+    df['question_id'] = pd.util.hash_pandas_object(df[FORM_COLUMNS], index=False).to_numpy().view(np.int64)
 
     return df
 
 def extract_form(df):
+    """
+    Extract the question dictionary of the response table, one row per question_id.
+    
+    Parameters:
+    df (pd.DataFrame): The response table, with a 'question_id' column.
 
+    Returns:
+    pd.DataFrame: The 'question_id' and FORM_COLUMNS of every distinct question.
+    """
 
     logging.info('extracting questions details')
     # Extract unique rows based on the specified columns
-    df_form = df[['module_short', 'question_type_pri', 'indicator', 'Core/Plus',\
-                'question_text', 'sub_question_text', 'sub_sub_question_text','sub_sub_sub_question_text']].drop_duplicates()
+    df_form = df[['question_id'] + FORM_COLUMNS].drop_duplicates()
+
+    if df_form['question_id'].duplicated().any():
+        logging.error(f"Question ID collision:\n{df_form[df_form['question_id'].duplicated(keep=False)]}")
 
     return df_form
 
+def build_fact_table(df):
+    """
+    Reduce the response table to its integer-coded facts.
+    
+    Parameters:
+    df (pd.DataFrame): The response table, with 'report_ID' and 'question_id' columns.
+
+    Returns:
+    pd.DataFrame: The 'report_ID', 'question_id', 'response_answer' and 'response' of every row.
+    """
+
+    return pd.DataFrame({'report_ID': df['report_ID'],
+                         'question_id': df['question_id'],
+                         'response_answer': df['response_answer'],
+                         'response': df[' Signatory_Public_Response ']})
+
+def expand_facts(df_facts, df_form, columns=FORM_COLUMNS):
+    """
+    Look the question texts of a fact table up in the question dictionary.
+    
+    Parameters:
+    df_facts (pd.DataFrame): The fact table, see build_fact_table.
+    df_form (pd.DataFrame): The question dictionary, see extract_form.
+    columns (list): The dictionary columns to add. Default is FORM_COLUMNS.
+
+    Returns:
+    pd.DataFrame: The fact table with the requested question columns.
+    """
+
+    df_form = df_form.drop_duplicates(subset='question_id').set_index('question_id')
+
+    return df_facts.join(df_form[columns], on='question_id')
+
+
+# Amounts like 'US$ 1,250,000.00', '12.5 bn USD' or '45%', and bands like '>10-50%'
+NUMBER_PATTERN = r'^(?P<currency>(?:[A-Z]{2,3}\s*)?[$€£¥]?)\s*(?P<bound>[<>]?)=?\s*(?P<low>-?\d*\.?\d+)\s*%?(?:\s*-\s*(?P<high>\d*\.?\d+))?\s*(?P<unit>[A-Za-z%]*)(?:\s+(?P<code>[A-Z]{3}))?$'
+THOUSANDS_PATTERN = r'(?<=\d)[,\s ](?=\d{3}(?!\d))'
+
+UNIT_MULTIPLIERS = {'': 1, 'k': 1e3, 'thousand': 1e3, 'm': 1e6, 'mn': 1e6, 'million': 1e6, 'bn': 1e9, 'billion': 1e9}
+USD_SYMBOLS = ['US$', '$', 'USD', 'US']
+
+def _parse_numbers(texts, question_type):
+
+    parts = texts.str.strip().str.replace(THOUSANDS_PATTERN, '', regex=True).str.extract(NUMBER_PATTERN)
+
+    low = pd.to_numeric(parts['low'])
+    high = pd.to_numeric(parts['high'])
+    bound = parts['bound'].fillna('')
+    unit = parts['unit'].fillna('')
+    currency = parts['currency'].fillna('').str.strip()
+    currency = currency.mask(currency == '', parts['code'].fillna(''))
+
+    # A trailing three-letter code is a currency, e.g. '1,000 USD'
+    code = unit.str.fullmatch(r'[A-Z]{3}')
+    currency = currency.mask(code & (currency == ''), unit)
+    unit = unit.mask(code, '')
+
+    # Percentages have no k/m/bn units
+    percentage = question_type == PERCENTAGE_TYPE_PRI
+    multiplier = unit.str.lower().map(UNIT_MULTIPLIERS)
+    if percentage:
+        multiplier = pd.Series(np.where(unit.isin(['', '%']), 1.0, np.nan), index=texts.index)
+
+    # Bands keep their bounds, open percentage bands are bounded by 0% and 100%
+    single = high.isna()
+    high = high.mask(single, low.mask(bound == '>', 100.0 if percentage else np.nan))
+    low = low.mask(single & (bound == '<'), 0.0)
+    low, high = low * multiplier, high * multiplier
+
+    if question_type == MONEY_TYPE_PRI:
+        invalid = texts.str.contains('%', regex=False)
+        currency = currency.replace(USD_SYMBOLS, 'USD').replace('', np.nan)
+    else:
+        invalid = currency != ''
+        currency = pd.Series(np.nan, index=texts.index, dtype=object)
+    if percentage:
+        invalid |= (low < 0) | (high > 100)
+
+    return pd.DataFrame({'low': low.mask(invalid).astype('float64'), 'high': high.mask(invalid).astype('float64'), 'currency': currency})
+
+def _parse_distinct(values, question_type):
+
+    # The distinct values are parsed once, missing values have code -1, which picks a missing row
+    codes, uniques = pd.factorize(values)
+    parsed = _parse_numbers(pd.Series(uniques, dtype=object).astype(str), question_type)
 
-def extract_survey(df_res, df, df_form):
+    return parsed.reindex(codes).set_axis(values.index)
+
+def parse_numeric(values, question_type=None):
+    """
+    Parse free-text numeric responses into floats.
+
+    Thousands separators, currency symbols or codes and the k/m/bn units are handled, as well as
+    band ranges such as '>10-50%', which count as their midpoint. Percentages stay on a 0-100 scale,
+    Money amounts given as percentages and percentages outside 0-100 are unparseable.
+    The distinct values are parsed once and mapped back to the rows.
     
-    questions = df_form['indicator'].unique()
-    questions_list = questions.tolist()
-    questions_list.sort()
+    Parameters:
+    values (pd.Series): The responses.
+    question_type (str): MONEY_TYPE_PRI, PERCENTAGE_TYPE_PRI, or None for plain numbers such as rates.
+
+    Returns:
+    pd.Series: The float64 values, NaN for missing and unparseable responses.
+    pd.Series: The currency of every Money response, 'USD' for the dollar symbols, NaN when not given.
+    """
+
+    parsed = _parse_distinct(values, question_type)
+
+    return ((parsed['low'] + parsed['high']) / 2).rename(values.name), parsed['currency'].rename(values.name)
+
+def parse_range(values, question_type=None):
+    """
+    Parse free-text numeric responses into the bounds of their band, see parse_numeric.
+
+    A single value is its own band, '>75%' is the band from 75 to 100 and '<5%' the one from 0 to 5.
+    
+    Parameters:
+    values (pd.Series): The responses.
+    question_type (str): MONEY_TYPE_PRI, PERCENTAGE_TYPE_PRI, or None for plain numbers such as rates.
+
+    Returns:
+    pd.Series: The float64 lower bounds, NaN for missing and unparseable responses.
+    pd.Series: The float64 upper bounds, NaN for missing and unparseable responses and for open Money bands.
+    pd.Series: The currency of every Money response, 'USD' for the dollar symbols, NaN when not given.
+    """
 
-    for q in questions_list:
-        question_type = df_form[(df_form['indicator'] == q)]['question_type_pri'].unique()
-        for t in question_type.tolist():
+    parsed = _parse_distinct(values, question_type)
 
-            public_response = ' Signatory_Public_Response '
+    return parsed['low'].rename(values.name), parsed['high'].rename(values.name), parsed['currency'].rename(values.name)
 
-            logging.info('extracting ' + q + ' (' + t + ')')
-            if q in ['OO 2.2', 'OO 5', 'OO 5.1', 'OO 5.2', 'OO 5.3 FI', 'OO 5.3 INF', 'OO 5.3 LE', 'OO 5.3 PE', 'OO 5.3 RE'] :
-                logging.error('Skipping ' + q + ' since it has multiple answers for a single choice')
+# Question types answered with a value rather than by selecting options
+VALUE_TYPES_PRI = ['Text', 'Money', 'Percentage']
 
-            elif q in ['OO 7', 'OO 8', 'OO 9', 'OO 11', 'OO 12', 'OO 13', 'OO 14', 'OO 18.2', 'OO 20', 'OO 21'] :
-                logging.error('Skipping ' + q + ' since it has multiple answers for a single choice')
-            
-            elif q == 'OO 4':
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == MONEY_TYPE_PRI) & (df['sub_question_text'] == 'A')], public_response, q +' A '+ MONEY_TYPE_PRI)
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == MONEY_TYPE_PRI) & (df['sub_question_text'] == 'B')], public_response, q +' B '+ MONEY_TYPE_PRI)
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == MONEY_TYPE_PRI) & (df['sub_question_text'] == 'C')], public_response, q +' C '+ MONEY_TYPE_PRI)
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == TEXT_TYPE_PRI)], public_response, q +' '+ TEXT_TYPE_PRI)
+SURVEY_KEYS = ['indicator', 'question_type_pri', 'sub_question_text', 'sub_sub_question_text', 'sub_sub_sub_question_text']
 
-            elif t == TEXT_TYPE_PRI:
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == TEXT_TYPE_PRI)], public_response, q +' '+ TEXT_TYPE_PRI)
-            elif t == MONEY_TYPE_PRI:
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == MONEY_TYPE_PRI)], public_response, q +' '+ MONEY_TYPE_PRI)
-            elif t == SINGLE_CHOICE_TYPE_PRI:
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == SINGLE_CHOICE_TYPE_PRI)], 'sub_question_text', q + ' sub')   
-                df_res = merge_and_rename_column(df_res,  df[(df['indicator'] == q) & (df['question_type_pri'] == SINGLE_CHOICE_TYPE_PRI)], 'sub_sub_question_text', q +' sub_sub')   
+def _label(*parts):
+
+    return ' '.join(str(part).strip() for part in parts if pd.notna(part))
+
+def extract_survey(df_res, df, df_form=None, multi_answer='indicator', sparse=False):
+    """
+    Add the Selected responses of every indicator to df_res as columns, one row per report_ID.
+
+    Text, Money and Percentage questions get a '<indicator> <sub labels> <type>' column with the
+    public response. Single choice indicators with one selected option per signatory keep the
+    '<indicator> sub' and '<indicator> sub_sub' columns of the selected option. Multi choice
+    indicators, and single choice ones where signatories select several options, become one
+    boolean '<indicator> <option labels>' column per option, or a single '<indicator> options'
+    column listing the selected options with multi_answer='list'. A value question answered
+    several times by the same signatory, e.g. the list of subsidiaries of OO 2.2, keeps the first
+    response, or becomes a column listing every response with multi_answer='list'.
+
+    The distinct questions are classified once and every response lands in its column in one pivot.
+
+    Parameters:
+    df_res (pd.DataFrame): The table to extend, one row per 'report_ID', usually the signatory profile.
+    df (pd.DataFrame): The Selected responses, with a 'report_ID' column.
+    df_form (pd.DataFrame): The question dictionary, only its indicators are extracted. Default is None, every indicator.
+    multi_answer (str): 'indicator' for boolean option columns or 'list' for list columns. Default is 'indicator'.
+    sparse (bool): Store the boolean option columns as sparse arrays. Default is False.
+
+    Returns:
+    pd.DataFrame: df_res with the survey columns, grouped by indicator in sorted order.
+    """
+
+    if multi_answer not in ('indicator', 'list'):
+        raise ValueError(f"Unsupported multi_answer '{multi_answer}', expected 'indicator' or 'list'")
+
+    if df_form is not None:
+        df = df[df['indicator'].isin(df_form['indicator'].unique())]
+    df = df[df['report_ID'].isin(df_res['report_ID'])]
+
+    logging.info(f"extracting {df['indicator'].nunique()} indicators")
+
+    # Every distinct question is classified once, the rows only carry its code in sorted question order
+    codes = pd.factorize(pd.util.hash_pandas_object(df[SURVEY_KEYS], index=False))[0]
+    questions = df[SURVEY_KEYS].iloc[np.unique(codes, return_index=True)[1]].astype(object).reset_index(drop=True)
+    questions = questions.sort_values(SURVEY_KEYS, na_position='first')
+    rank = np.empty(len(questions), dtype=np.int64)
+    rank[questions.index] = np.arange(len(questions))
+    codes = rank[codes]
+    questions = questions.reset_index(drop=True)
+
+    choices = df[~df['question_type_pri'].isin(VALUE_TYPES_PRI)]
+    counts = choices.groupby(['report_ID', 'indicator', 'question_type_pri'], observed=True).size()
+    multi = set(counts[counts > 1].droplevel('report_ID').index)
+
+    report_ids = pd.Index(df_res['report_ID'].dropna().unique())
+    rows = report_ids.get_indexer(df['report_ID'])
+
+    # (column, field) pairs of the value questions, option column and label of the multi-answer options
+    value_columns = {}
+    options = {}
+    for code, q in enumerate(questions.to_dict('records')):
+        if q['question_type_pri'] in VALUE_TYPES_PRI:
+            value_columns[code] = [(_label(q['indicator'], q['sub_question_text'], q['sub_sub_question_text'], q['question_type_pri']), ' Signatory_Public_Response ')]
+        elif q['question_type_pri'] == MULTI_TYPE_PRI or (q['indicator'], q['question_type_pri']) in multi:
+            label = _label(q['sub_question_text'], q['sub_sub_question_text'], q['sub_sub_sub_question_text'])
+            options[code] = (_label(q['indicator'], label) if multi_answer == 'indicator' else q['indicator'] + ' options', label)
+        else:
+            value_columns[code] = [(q['indicator'] + ' sub', 'sub_question_text'), (q['indicator'] + ' sub_sub', 'sub_sub_question_text')]
+
+    column_order = list(dict.fromkeys(column for code in range(len(questions))\
+                                      for column in ([pair[0] for pair in value_columns[code]] if code in value_columns else [options[code][0]])))
+
+    frames = []
+
+    # Positions of the rows of every question, and the value fields converted once
+    positions = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[positions], np.arange(len(questions) + 1))
+    fields = {field: df[field].to_numpy(dtype=object) for field in {field for pairs in value_columns.values() for _, field in pairs}}
+
+    pieces = []
+    for code, pairs in value_columns.items():
+        selected = positions[bounds[code]:bounds[code + 1]]
+        for column, field in pairs:
+            pieces.append(pd.DataFrame({'row': rows[selected], 'column': column, 'value': fields[field][selected]}))
+
+    if pieces:
+        long = pd.concat(pieces, ignore_index=True)
+        duplicated = long.duplicated(['row', 'column'])
+        if duplicated.any():
+            collisions = long[duplicated].groupby('column').size()
+            if multi_answer == 'list':
+                logging.info(f"Several responses for the same report_ID, listing them:\n{collisions.to_string()}")
+                repeated = long['column'].isin(collisions.index)
+                lists = long[repeated].groupby(['row', 'column'], sort=False)['value'].agg(list).unstack('column')
+                frames.append(lists.reindex(range(len(report_ids))))
+                long = long[~repeated]
             else:
-                logging.error('Unsupported question type: ' + t)
+                logging.error(f"Several responses for the same report_ID, keeping the first one, use multi_answer='list' to keep them all:\n{collisions.to_string()}")
+                long = long[~duplicated]
+        frames.append(long.pivot(index='row', columns='column', values='value').reindex(range(len(report_ids))))
+
+    if options:
+        option_names = list(dict.fromkeys(column for column, _ in options.values()))
+        option_codes = np.full(len(questions), -1)
+        labels = np.empty(len(questions), dtype=object)
+        for code, (column, label) in options.items():
+            option_codes[code] = option_names.index(column)
+            labels[code] = label
+
+        selected = np.flatnonzero(option_codes[codes] >= 0)
+        columns = option_codes[codes[selected]]
+
+        if multi_answer == 'list':
+            lists = pd.DataFrame({'row': rows[selected], 'column': columns, 'value': labels[codes[selected]]})
+            lists = lists.groupby(['row', 'column'])['value'].agg(list).unstack('column').reindex(index=range(len(report_ids)), columns=range(len(option_names)))
+            lists.columns = option_names
+            frames.append(lists)
+        else:
+            matrix = np.zeros((len(report_ids), len(option_names)), dtype=bool)
+            matrix[rows[selected], columns] = True
+            if sparse:
+                frames.append(pd.DataFrame({column: pd.arrays.SparseArray(matrix[:, i], fill_value=False) for i, column in enumerate(option_names)}))
+            else:
+                frames.append(pd.DataFrame(matrix, columns=option_names))
+
+    wide = pd.concat(frames, axis=1)[column_order] if frames else pd.DataFrame(index=range(len(report_ids)))
+    wide.index = report_ids
+    wide.columns.name = None
+
+    df_res = df_res.join(wide, on='report_ID')
 
+    # Rows without a report_ID get False in the option columns rather than a missing value
+    for column in column_order:
+        if pd.api.types.is_bool_dtype(wide[column].dtype) and df_res[column].isna().any():
+            df_res[column] = df_res[column].fillna(False).astype(wide[column].dtype)
 
     return df_res
 
@@ -179,6 +936,7 @@ TEXT_TYPE_PRI = 'Text'
 MONEY_TYPE_PRI = 'Money'
 SINGLE_CHOICE_TYPE_PRI = 'Single Choice'
 MULTI_TYPE_PRI = 'Multi Choice'
+PERCENTAGE_TYPE_PRI = 'Percentage'
 
 
 if __name__ == '__main__':
@@ -189,6 +947,7 @@ if __name__ == '__main__':
 
     logging.info('starting from this file')
     df = load_csv(OO_file, encoding='ISO-8859-1')
+    df = set_question_id(df)
 
 
     df_signatory = build_signatory_profile(df[df['indicator'] == 'OO 1'])
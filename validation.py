@@ -0,0 +1,225 @@
+import json, logging
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import utils
+
+
+public_response = ' Signatory_Public_Response '
+
+# (rule, column, check, argument, question types the rule is restricted to)
+# Every check but 'not_null' ignores missing values, the argument of a 'numeric' check is the question type parsed
+# with utils.parse_numeric
+FORMAT_CHECKS = [
+    ('sub_question_label', 'sub_question_text', 'regex', r'^\([A-Za-z0-9]+\)\s.+', None),
+    ('indicator_not_null', 'indicator', 'not_null', None, None),
+    ('signatory_not_null', 'Signatory Name', 'not_null', None, None),
+    ('report_id_not_null', 'report_ID', 'not_null', None, None),
+    ('question_type_allowed', 'question_type_pri', 'allowed', [utils.TEXT_TYPE_PRI, utils.MONEY_TYPE_PRI, utils.PERCENTAGE_TYPE_PRI,\
+                                                               utils.SINGLE_CHOICE_TYPE_PRI, utils.MULTI_TYPE_PRI], None),
+    ('numeric_response', public_response, 'numeric', utils.MONEY_TYPE_PRI, [utils.MONEY_TYPE_PRI]),
+    ('numeric_response', public_response, 'numeric', utils.PERCENTAGE_TYPE_PRI, [utils.PERCENTAGE_TYPE_PRI]),
+]
+
+def _is_numeric(values, question_type):
+
+    return utils.parse_numeric(values, question_type)[0].notna()
+
+def _failed_rows(values, check, argument):
+    """
+    Evaluate a check on the distinct values of a column and map the result back to the rows.
+    
+    Parameters:
+    values (pd.Series): The values to check.
+    check (str): One of 'regex', 'not_null', 'allowed' or 'numeric'.
+    argument: The pattern of a 'regex' check, the list of values of an 'allowed' check or the question type of a 'numeric' check.
+
+    Returns:
+    np.ndarray: A boolean mask of the rows failing the check.
+    """
+
+    if check == 'not_null':
+        return values.isna().to_numpy()
+
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques)
+
+    if check == 'regex':
+        passed = uniques.astype(str).str.match(argument)
+    elif check == 'allowed':
+        passed = uniques.isin(argument)
+    elif check == 'numeric':
+        passed = _is_numeric(uniques, argument)
+    else:
+        logging.error('Unsupported check: ' + check)
+        return np.zeros(len(values), dtype=bool)
+
+    return (codes >= 0) & ~passed.to_numpy(dtype=bool)[codes]
+
+def run_checks(df, checks=FORMAT_CHECKS):
+    """
+    Run column checks over the response table.
+    
+    Parameters:
+    df (pd.DataFrame): The response table.
+    checks (list): (rule, column, check, argument, question types) tuples. Default is FORMAT_CHECKS.
+
+    Returns:
+    pd.DataFrame: One row per violation with the UID of the response, its report_ID, indicator, rule and value.
+    pd.DataFrame: The number of violations per (indicator, rule).
+    """
+
+    violations = []
+
+    for rule, col, check, argument, question_types in checks:
+
+        if col not in df.columns:
+            logging.error(f"Column '{col}' of check {rule} is not in the DataFrame")
+            continue
+
+        if question_types is None:
+            positions = np.arange(len(df))
+        else:
+            positions = np.flatnonzero(df['question_type_pri'].isin(question_types).to_numpy())
+
+        values = df[col].iloc[positions]
+        rows = positions[_failed_rows(values, check, argument)]
+
+        violations.append(pd.DataFrame({'UID': df['UID'].iloc[rows].to_numpy() if 'UID' in df.columns else np.nan,
+                                        'report_ID': df['report_ID'].iloc[rows].to_numpy() if 'report_ID' in df.columns else np.nan,
+                                        'indicator': df['indicator'].iloc[rows].to_numpy(),
+                                        'rule': rule,
+                                        'value': df[col].iloc[rows].astype(str).to_numpy()}))
+
+    violations = pd.concat(violations, ignore_index=True) if violations else\
+        pd.DataFrame(columns=['UID', 'report_ID', 'indicator', 'rule', 'value'])
+    violations['indicator'] = violations['indicator'].astype('category')
+    violations['rule'] = violations['rule'].astype('category')
+
+    return violations, summarize(violations)
+
+def summarize(violations):
+    """
+    Count the violations per (indicator, rule).
+    
+    Parameters:
+    violations (pd.DataFrame): The violations returned by run_checks, possibly concatenated over several chunks.
+
+    Returns:
+    pd.DataFrame: The number of violations per (indicator, rule), sorted by indicator and rule.
+    """
+
+    keys = [violations['indicator'].astype(str), violations['rule'].astype(str)]
+
+    return violations.groupby(keys).size().rename('violations').reset_index()
+
+def write_report(violations, summary, filename):
+    """
+    Write the violations to a single Parquet file, with the per (indicator, rule) counts
+    stored in its 'validation_summary' metadata.
+    
+    Parameters:
+    violations (pd.DataFrame): The violations returned by run_checks.
+    summary (pd.DataFrame): The counts returned by run_checks.
+    filename (str): The path of the Parquet file.
+    """
+
+    if pa is None:
+        logging.error('pyarrow is not installed, cannot write validation report ' + filename)
+        return
+
+    table = pa.Table.from_pandas(violations, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'validation_summary'] = json.dumps(summary.astype({'indicator': str, 'rule': str}).to_dict('records')).encode()
+
+    pq.write_table(table.replace_schema_metadata(metadata), filename)
+
+class ReportWriter:
+    """
+    Write the violations of a table checked chunk by chunk to a single Parquet report, as write_report
+    does for a whole table, keeping only the per (indicator, rule) counts in memory.
+
+    Each chunk with violations is a row group of the report, the counts are stored in its
+    'validation_summary' metadata on close.
+
+    Parameters:
+    filename (str): The path of the Parquet file. Default is None, only the counts are kept.
+    """
+
+    def __init__(self, filename=None):
+
+        if filename is not None and pa is None:
+            logging.error('pyarrow is not installed, cannot write validation report ' + filename)
+            filename = None
+
+        self.filename = filename
+        self.summary = summarize(pd.DataFrame(columns=['indicator', 'rule']))
+        self._schema = None
+        self._sink = None
+
+    def append(self, violations):
+        """
+        Add the violations of the next chunk.
+
+        Parameters:
+        violations (pd.DataFrame): The violations returned by run_checks on the chunk.
+        """
+
+        if violations.empty:
+            return
+
+        counts = pd.concat([self.summary, summarize(violations)])
+        self.summary = counts.groupby(['indicator', 'rule'], as_index=False)['violations'].sum()
+
+        if self.filename is None:
+            return
+
+        table = pa.Table.from_pandas(violations, preserve_index=False, schema=self._schema)
+        if self._sink is None:
+            # Every chunk has its own categories, widen the dictionaries once for all of them
+            self._schema = pa.schema([field.with_type(pa.dictionary(pa.int32(), field.type.value_type))\
+                                      if pa.types.is_dictionary(field.type) else field for field in table.schema])
+            table = table.cast(self._schema)
+            self._sink = pq.ParquetWriter(self.filename, self._schema)
+        self._sink.write_table(table)
+
+    def close(self):
+        """
+        Write the counts to the report and close it.
+
+        Returns:
+        pd.DataFrame: The number of violations per (indicator, rule), as returned by run_checks.
+        """
+
+        if self._sink is not None:
+            self._sink.add_key_value_metadata({'validation_summary': json.dumps(self.summary.to_dict('records'))})
+            self._sink.close()
+            self._sink = None
+        elif self.filename is not None:
+            write_report(pd.DataFrame(columns=['UID', 'report_ID', 'indicator', 'rule', 'value']), self.summary, self.filename)
+
+        return self.summary
+
+def read_report(filename):
+    """
+    Read a validation report written by write_report.
+    
+    Parameters:
+    filename (str): The path of the Parquet file.
+
+    Returns:
+    pd.DataFrame: The violations.
+    pd.DataFrame: The number of violations per (indicator, rule).
+    """
+
+    # The counts are in the key-value metadata of the file, where ReportWriter can only add them on close
+    metadata = pq.read_metadata(filename).metadata
+    summary = pd.DataFrame(json.loads(metadata[b'validation_summary']), columns=['indicator', 'rule', 'violations'])
+
+    return pq.read_table(filename).to_pandas(), summary
@@ -0,0 +1,235 @@
+import os, shutil, logging
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+OUTPUT_FORMATS = ['csv', 'feather', 'parquet']
+
+# Extension of the CSV files by compression. Only stream compressions are supported, as appended
+# chunks are written as successive streams of the same file, which zip and tar archives do not allow
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+# Tables of a run: the signatory profile, the question dictionary, the integer-coded facts and the full-text response table
+OUTPUT_TABLES = ['signatory', 'questions', 'facts', 'test']
+
+def _normalize_schema(schema):
+
+    # Later chunks may hold values where the first one only had nulls, and categoricals of
+    # different sizes, so widen those types once for every chunk of a table
+    fields = []
+    for field in schema:
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        fields.append(field)
+
+    return pa.schema(fields, metadata=schema.metadata)
+
+def _extend_dictionaries(table, dictionaries):
+
+    # An Arrow IPC file only lets the dictionary of a column grow from one batch to the next, so the
+    # dictionary columns of every chunk are re-encoded against the values of the previous chunks
+    table = table.unify_dictionaries()
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_dictionary(field.type):
+            array = column.combine_chunks()
+            known = dictionaries.get(field.name, pa.array([], type=field.type.value_type))
+            known = pa.concat_arrays([known, pc.filter(array.dictionary, pc.invert(pc.is_in(array.dictionary, known)))])
+            dictionaries[field.name] = known
+            indices = pc.take(pc.index_in(array.dictionary, known), array.indices).cast(field.type.index_type)
+            column = pa.DictionaryArray.from_arrays(indices, known, ordered=field.type.ordered)
+        columns.append(column)
+
+    return pa.Table.from_arrays(columns, schema=table.schema)
+
+def arrow_compatible(df):
+    """
+    Return df with the object columns mixing value types, e.g. booleans and strings, cast to
+    strings so the frame can be converted to Arrow. df itself is left untouched.
+
+    Parameters:
+    df (pd.DataFrame): The table.
+
+    Returns:
+    pd.DataFrame: The convertible table.
+    """
+
+    mixed = [col for col in df.select_dtypes('object').columns\
+             if pd.api.types.infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer')]
+
+    return df.assign(**{col: df[col].astype('string') for col in mixed}) if mixed else df
+
+class OutputWriter:
+    """
+    Write the tables of a run to output_dir in a background thread.
+
+    Writes are queued and run one at a time in submission order, so exporting a table overlaps
+    with the processing that follows. A DataFrame must not be modified once it was handed over.
+    Call close, or use the writer as a context manager, to wait for the writes and raise their errors.
+
+    A table is a single file whether it is written at once or appended chunk by chunk, the chunks
+    being row groups of a Parquet file or record batches of a Feather file. Only partitioned Parquet
+    tables are directories, with one file per partition and chunk.
+
+    Parameters:
+    output_dir (str): The directory receiving the tables.
+    output_format (str): One of OUTPUT_FORMATS. Default is 'csv'.
+    partition_by (str): Column the Parquet tables holding it are partitioned by, e.g. 'indicator' or 'module_short'. Default is None.
+    compression (str): Compression of the CSV files, one of COMPRESSION_EXTENSIONS. Default is None.
+    tables (list): The tables written, the others are skipped, e.g. without 'test' when the facts and questions suffice. Default is None, every table.
+    """
+
+    def __init__(self, output_dir, output_format='csv', partition_by=None, compression=None, tables=None):
+
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+        if output_format != 'csv' and pa is None:
+            raise ImportError(f"pyarrow is required to write {output_format} files")
+        if partition_by is not None and output_format != 'parquet':
+            logging.error('Partitioning is only supported by the parquet format, ignoring partition_by')
+        if compression is not None and compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unsupported compression '{compression}', expected one of {list(COMPRESSION_EXTENSIONS)}")
+        if compression is not None and output_format != 'csv':
+            logging.error('Compression is only supported by the csv format, ignoring compression')
+
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.partition_by = partition_by
+        self.compression = compression
+        self.tables = tables
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+        self._parts = {}
+        self._schemas = {}
+        self._sinks = {}
+        self._dictionaries = {}
+
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def writes(self, name):
+        """
+        Return whether a table is written or skipped.
+        """
+
+        return self.tables is None or name in self.tables
+
+    def path(self, name):
+        """
+        Return the path a table is written to.
+
+        Parameters:
+        name (str): The name of the table, e.g. 'signatory'.
+
+        Returns:
+        str: A file, or a directory for partitioned Parquet tables.
+        """
+
+        if self.output_format == 'csv':
+            return os.path.join(self.output_dir, name + '.csv' + COMPRESSION_EXTENSIONS.get(self.compression, ''))
+
+        return os.path.join(self.output_dir, name + '.' + self.output_format)
+
+    def write(self, name, df):
+        """
+        Queue the export of a whole table.
+
+        Parameters:
+        name (str): The name of the table, e.g. 'signatory'.
+        df (pd.DataFrame): The table.
+        """
+
+        if not self.writes(name):
+            return
+
+        logging.info('Exporting ' + name + ' to ' + self.path(name))
+        self._futures.append(self._executor.submit(self._write, name, df, None))
+
+    def append(self, name, df):
+        """
+        Queue the export of the next chunk of a table written over several calls.
+
+        Parameters:
+        name (str): The name of the table, e.g. 'test'.
+        df (pd.DataFrame): The chunk.
+        """
+
+        if not self.writes(name):
+            return
+
+        part = self._parts.get(name, 0)
+        self._parts[name] = part + 1
+        self._futures.append(self._executor.submit(self._write, name, df, part))
+
+    def close(self):
+        """
+        Wait for the queued writes and raise the first error.
+        """
+
+        self._executor.shutdown(wait=True)
+
+        for sink in self._sinks.values():
+            sink.close()
+        self._sinks = {}
+
+        for future in self._futures:
+            future.result()
+        self._futures = []
+
+    def _write(self, name, df, part):
+
+        path = self.path(name)
+
+        if self.output_format == 'csv':
+            first = part is None or part == 0
+            df.to_csv(path, mode='w' if first else 'a', header=first, index=False, compression=self.compression)
+            return
+
+        table = pa.Table.from_pandas(arrow_compatible(df), preserve_index=False, schema=self._schemas.get(name))
+        if name not in self._schemas:
+            self._schemas[name] = _normalize_schema(table.schema)
+            table = table.cast(self._schemas[name])
+
+        # Clear the output of a previous run, partitioned tables would otherwise keep its files
+        if not part and os.path.isdir(path):
+            shutil.rmtree(path)
+        elif not part and os.path.exists(path):
+            os.remove(path)
+
+        partitioned = self.output_format == 'parquet' and self.partition_by in df.columns
+
+        if partitioned:
+            pq.write_to_dataset(table, path, partition_cols=[self.partition_by],\
+                                basename_template=f'part-{part or 0:05d}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore')
+        elif part is None:
+            if self.output_format == 'parquet':
+                pq.write_table(table, path)
+            else:
+                feather.write_feather(table, path)
+        else:
+            # Appended chunks go to a writer kept open until close, Feather files being Arrow IPC files
+            if name not in self._sinks:
+                if self.output_format == 'parquet':
+                    self._sinks[name] = pq.ParquetWriter(path, table.schema)
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression='lz4' if pa.Codec.is_available('lz4') else None, emit_dictionary_deltas=True)
+                    self._sinks[name] = pa.ipc.new_file(path, table.schema, options=options)
+            if self.output_format == 'feather':
+                table = _extend_dictionaries(table, self._dictionaries.setdefault(name, {}))
+            self._sinks[name].write_table(table)